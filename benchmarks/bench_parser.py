@@ -0,0 +1,75 @@
+import argparse
+import random
+import re
+import time
+from typing import Callable, List
+
+import src.app.module as app
+
+LEGACY_PATTERN = r"(?:GET|POST|PUT|DELETE|HEAD|OPTIONS|PATCH)\s+(?P<url>[^\s]+).*?\s+(?P<request_time>\d+\.\d+)$"
+
+LINE_TEMPLATE = (
+    '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "{method} {url} HTTP/1.1" 200 927 '
+    '"-" "Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" '
+    '"1498697422-2190034393-4708-9752759" "dc7161be3" {request_time:.3f}\n'
+)
+
+
+def generate_lines(count: int, urls: int, seed: int = 0) -> List[bytes]:
+    rnd = random.Random(seed)
+    methods = ["GET", "GET", "GET", "POST"]
+
+    return [
+        LINE_TEMPLATE.format(
+            method=rnd.choice(methods),
+            url=f"/api/v2/banner/{rnd.randrange(urls)}",
+            request_time=rnd.expovariate(5),
+        ).encode("utf-8")
+        for _ in range(count)
+    ]
+
+
+def parse_line_legacy(line: bytes):
+    line_match = re.search(LEGACY_PATTERN, line.decode("utf-8"))
+
+    if not line_match:
+        return None
+
+    entry = line_match.groupdict()
+    return entry["url"], float(entry["request_time"])
+
+
+def measure(parse_line: Callable, lines: List[bytes], repeat: int) -> float:
+    best = float("inf")
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for line in lines:
+            parse_line(line)
+        best = min(best, time.perf_counter() - started)
+
+    return len(lines) / best
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Line parser micro-benchmark")
+    argparser.add_argument("--lines", type=int, default=200_000)
+    argparser.add_argument("--urls", type=int, default=10_000)
+    argparser.add_argument("--repeat", type=int, default=3)
+    args = argparser.parse_args()
+
+    lines = generate_lines(args.lines, args.urls)
+    parsers = {"legacy": parse_line_legacy, **app.LINE_PARSERS}
+
+    baseline = None
+    for name, parse_line in parsers.items():
+        lines_per_sec = measure(parse_line, lines, args.repeat)
+        baseline = baseline or lines_per_sec
+        print(
+            f"{name:>10}: {lines_per_sec:>12,.0f} lines/sec "
+            f"({lines_per_sec / baseline:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
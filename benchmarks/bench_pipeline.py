@@ -0,0 +1,245 @@
+import argparse
+import gzip
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import src.app.module as app
+from benchmarks.bench_parser import LINE_TEMPLATE
+
+RESULTS_PATH = "benchmarks/results.jsonl"
+GENERATE_BATCH = 10_000
+MIN_STAGE_SECONDS = 0.05
+
+DISTRIBUTIONS: Dict[str, Callable[[random.Random], float]] = {
+    "exponential": lambda rnd: rnd.expovariate(5),
+    "lognormal": lambda rnd: rnd.lognormvariate(-2, 1),
+    "uniform": lambda rnd: rnd.uniform(0, 1),
+}
+
+
+def generate_log(
+    log_path: Path,
+    lines: int,
+    urls: int,
+    distribution: str = "exponential",
+    error_ratio: float = 0.0,
+    compress: bool = False,
+    seed: int = 0,
+) -> int:
+    rnd = random.Random(seed)
+    request_time = DISTRIBUTIONS[distribution]
+    methods = ["GET", "GET", "GET", "POST"]
+    opener = gzip.open if compress else open
+
+    with opener(log_path, mode="wb") as log_file:
+        for batch_start in range(0, lines, GENERATE_BATCH):
+            batch = []
+
+            for _ in range(min(GENERATE_BATCH, lines - batch_start)):
+                if rnd.random() < error_ratio:
+                    batch.append(b'1.196.116.32 -  - [-] "-" 400 0 "-" "-" -\n')
+                    continue
+
+                batch.append(
+                    LINE_TEMPLATE.format(
+                        method=rnd.choice(methods),
+                        url=f"/api/v2/banner/{rnd.randrange(urls)}",
+                        request_time=request_time(rnd),
+                    ).encode("utf-8")
+                )
+
+            log_file.write(b"".join(batch))
+
+    return log_path.stat().st_size
+
+
+def measure_stages(
+    log_path: Path, extention: str, report_path: Path, options: app.ParseOptions
+) -> Dict:
+    stats = app.PipelineStats()
+
+    with stats.stage("parse") as record:
+        parser_output = app.parse_log(str(log_path), extention, options)
+        record["lines"] = parser_output.total["entries"]
+        record["bytes"] = log_path.stat().st_size
+
+    metrics = app.get_report_metrics(parser_output, app.ReportOptions(), stats)
+    app.write_report(str(report_path), metrics, app.ReportOptions(), stats)
+
+    return stats.as_dict()
+
+
+def measure_main(log_dir: Path, report_dir: Path, config: Dict) -> float:
+    config_path = log_dir.parent / "config.json"
+    config_path.write_text(
+        json.dumps(
+            {
+                **config,
+                "LOG_DIR": str(log_dir),
+                "REPORT_DIR": str(report_dir),
+                "LOG_LEVEL": "ERROR",
+            }
+        )
+    )
+
+    started = time.perf_counter()
+    app.main(["--config", str(config_path)])
+    return time.perf_counter() - started
+
+
+def get_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(results_path: Path) -> List[Dict]:
+    if not results_path.exists():
+        return []
+
+    with open(results_path, encoding="utf-8") as results_file:
+        return [json.loads(line) for line in results_file if line.strip()]
+
+
+def find_regressions(result: Dict, previous: Dict, tolerance: float) -> List[str]:
+    regressions = []
+    stages = result["stages"]["stages"]
+    previous_stages = previous["stages"]["stages"]
+
+    throughputs = {
+        name: (record.get("lines_per_sec"), previous_stages[name].get("lines_per_sec"))
+        for name, record in stages.items()
+        if previous_stages.get(name, {}).get("wall_time", 0) >= MIN_STAGE_SECONDS
+    }
+    throughputs["main"] = (result["main_lines_per_sec"], previous["main_lines_per_sec"])
+
+    for name, (lines_per_sec, previous_lines_per_sec) in throughputs.items():
+        if lines_per_sec and previous_lines_per_sec:
+            if lines_per_sec < previous_lines_per_sec * (1 - tolerance):
+                regressions.append(
+                    f"{name}: {lines_per_sec:,.0f} lines/sec, "
+                    f"was {previous_lines_per_sec:,.0f}"
+                )
+
+    peak_rss_mb = result["stages"]["peak_rss_mb"]
+    previous_peak_rss_mb = previous["stages"]["peak_rss_mb"]
+
+    if previous_peak_rss_mb and peak_rss_mb > previous_peak_rss_mb * (1 + tolerance):
+        regressions.append(
+            f"peak_rss_mb: {peak_rss_mb:,.1f}, was {previous_peak_rss_mb:,.1f}"
+        )
+
+    return regressions
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Log analyzer pipeline benchmark")
+    argparser.add_argument("--lines", type=int, default=500_000)
+    argparser.add_argument("--urls", type=int, default=10_000)
+    argparser.add_argument(
+        "--distribution", choices=list(DISTRIBUTIONS), default="exponential"
+    )
+    argparser.add_argument("--error-ratio", type=float, default=0.0)
+    argparser.add_argument("--gzip", action="store_true")
+    argparser.add_argument("--workers", type=int, default=1)
+    argparser.add_argument("--results", default=RESULTS_PATH)
+    argparser.add_argument("--tolerance", type=float, default=0.1)
+    args = argparser.parse_args()
+
+    app._configure_logger(None, "ERROR")
+
+    params = {
+        "lines": args.lines,
+        "urls": args.urls,
+        "distribution": args.distribution,
+        "error_ratio": args.error_ratio,
+        "gzip": args.gzip,
+        "workers": args.workers,
+    }
+    extention = ".gz" if args.gzip else ""
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        log_dir = Path(temp_dir) / "log"
+        report_dir = Path(temp_dir) / "reports"
+        log_dir.mkdir()
+        report_dir.mkdir()
+
+        log_path = log_dir / f"nginx-access-ui.log-20170630{extention}"
+
+        started = time.perf_counter()
+        log_size = generate_log(
+            log_path,
+            args.lines,
+            args.urls,
+            args.distribution,
+            args.error_ratio,
+            args.gzip,
+        )
+        print(
+            f"generated {args.lines:,} lines, {log_size / (1 << 20):,.1f} MB "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+
+        stages = measure_stages(
+            log_path,
+            extention,
+            report_dir / "report-stages.html",
+            app.ParseOptions(workers=args.workers),
+        )
+        end_to_end = measure_main(log_dir, report_dir, {"WORKERS": args.workers})
+
+    result = {
+        "revision": get_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "params": params,
+        "log_size": log_size,
+        "stages": stages,
+        "main_seconds": round(end_to_end, 6),
+        "main_lines_per_sec": round(args.lines / end_to_end, 1),
+    }
+
+    for name, record in stages["stages"].items():
+        print(
+            f"{name:>20}: {record['wall_time']:>9.3f}s wall "
+            f"{record['cpu_time']:>9.3f}s cpu "
+            f"{record.get('lines_per_sec') or 0:>12,.0f} lines/sec"
+        )
+
+    print(
+        f"{'main':>20}: {end_to_end:>9.3f}s wall "
+        f"{result['main_lines_per_sec']:>12,.0f} lines/sec, "
+        f"peak rss {stages['peak_rss_mb']:,.1f} MB"
+    )
+
+    results_path = Path(args.results)
+    previous = [r for r in load_results(results_path) if r["params"] == params]
+
+    with open(results_path, mode="a", encoding="utf-8") as results_file:
+        results_file.write(json.dumps(result) + "\n")
+
+    if not previous:
+        return
+
+    regressions = find_regressions(result, previous[-1], args.tolerance)
+
+    for regression in regressions:
+        print(f"REGRESSION {regression} ({previous[-1]['revision']})")
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
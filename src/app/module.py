@@ -1,25 +1,803 @@
+import bz2
+import contextlib
+import cProfile
+import csv
+import functools
 import gzip
+import hashlib
+import heapq
+import io
 import json
 import logging
 import logging.config
 import logging.handlers
+import lzma
+import math
+import mmap
 import os
+import pickle
+import pstats
+import queue
 import re
-import statistics
+import shutil
+import signal
+import sqlite3
+import subprocess
 import sys
-from collections import namedtuple
-from typing import IO, Dict, Generator, List, Optional
+import threading
+import time
+from array import array
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Generator, Iterable, List, Optional, Tuple, cast
 
 import structlog
 
+try:
+    import numpy as np  # type: ignore[import-not-found]
+except ImportError:
+    np = None  # type: ignore[assignment]
+
+try:
+    import pyarrow  # type: ignore[import-not-found]
+    import pyarrow.parquet  # type: ignore[import-not-found]
+except ImportError:
+    pyarrow = None  # type: ignore[assignment]
+
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore[assignment]
+
+try:
+    import zstandard  # type: ignore[import-not-found]
+except ImportError:
+    zstandard = None  # type: ignore[assignment]
+
+
+def _open_zstd(log_path: str, mode: str = "rb") -> io.BufferedIOBase:
+    if zstandard is None:
+        raise OSError(f"zstandard package is not installed, can not open {log_path}")
+
+    reader = zstandard.ZstdDecompressor().stream_reader(
+        open(log_path, mode=mode), closefd=True
+    )
+    return cast(io.BufferedIOBase, reader)
+
+
+CODECS: Dict = {
+    ".gz": gzip.open,
+    ".bz2": bz2.open,
+    ".xz": lzma.open,
+    ".zst": _open_zstd,
+}
+CODEC_ERRORS: Tuple = (OSError, EOFError, lzma.LZMAError) + (
+    (zstandard.ZstdError,) if zstandard is not None else ()
+)
+
+LOG_NAME_PATTERN = (
+    r"^nginx-access-ui\.log-(?P<date>\d{8})(?:"
+    + "|".join(re.escape(extention) for extention in CODECS)
+    + ")?$"
+)
+REPORT_TEMPLATE_PATH = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "report.html")
+)
+
 config: Dict = {
     "REPORT_SIZE": 1000,
     "REPORT_DIR": "./reports",
     "LOG_DIR": "./log",
+    "WORKERS": 1,
+    "QUANTILE_BACKEND": "exact",
+    "METRICS_ENGINE": "python",
+    "LOG_PARSER": "regex",
+    "LOG_FORMAT": None,
+    "LOG_NAME_PATTERN": LOG_NAME_PATTERN,
+    "DECOMPRESS_THREAD": True,
+    "GZIP_COMMAND": None,
+    "INCREMENTAL": False,
+    "CHECKPOINT_DIR": "./checkpoints",
+    "BACKFILL": False,
+    "BACKFILL_WORKERS": 1,
+    "AGGREGATE_STORE": None,
+    "REPORT_RANGE": None,
+    "PARSE_CACHE_DIR": None,
+    "PARSE_CACHE_MAX_AGE": 604800,
+    "PARSE_CACHE_MAX_SIZE": 1 << 30,
+    "OVERWRITE_REPORT": False,
+    "LOG_LEVEL": "INFO",
+    "PARSE_ERROR_SAMPLES": 10,
+    "MAX_ERROR_RATIO": None,
+    "STATS_FILE": False,
+    "PROFILE": None,
+    "PROFILE_TOP": 30,
+    "URL_QUERY": "keep",
+    "URL_COLLAPSE_IDS": False,
+    "URL_REWRITE_RULES": [],
+    "HEAVY_HITTERS": False,
+    "HEAVY_HITTERS_CAPACITY": None,
+    "REPORT_TEMPLATE": REPORT_TEMPLATE_PATH,
+    "REPORT_FORMAT": "html",
+    "REPORT_PAGE_SIZE": 0,
 }
 
 LogFile = namedtuple("LogFile", ["name", "date", "extention"])
-ParserOutput = namedtuple("ParserOutput", ["entries", "total"])
+ParserOutput = namedtuple(
+    "ParserOutput", ["entries", "total", "errors"], defaults=[None]
+)
+ParseOptions = namedtuple(
+    "ParseOptions",
+    [
+        "log_parser",
+        "quantile_backend",
+        "log_format",
+        "workers",
+        "decompress_thread",
+        "gzip_command",
+        "error_samples",
+        "max_error_ratio",
+        "url_query",
+        "url_collapse_ids",
+        "url_rewrite_rules",
+        "heavy_hitters_capacity",
+    ],
+    defaults=[
+        "regex",
+        "exact",
+        None,
+        1,
+        True,
+        None,
+        10,
+        None,
+        "keep",
+        False,
+        (),
+        None,
+    ],
+)
+ReportOptions = namedtuple(
+    "ReportOptions",
+    [
+        "report_size",
+        "metrics_engine",
+        "aggregate_store",
+        "stats_file",
+        "template_path",
+        "report_format",
+        "page_size",
+    ],
+    defaults=[1000, "python", None, False, REPORT_TEMPLATE_PATH, "html", 0],
+)
+Checkpoint = namedtuple(
+    "Checkpoint",
+    ["log_path", "inode", "offset", "parse_key", "head_hash", "parser_output"],
+)
+CacheOptions = namedtuple(
+    "CacheOptions",
+    ["cache_dir", "max_age", "max_size"],
+    defaults=[None, 604800, 1 << 30],
+)
+CacheEntry = namedtuple("CacheEntry", ["fingerprint", "parser_output"])
+
+LogEntry = Tuple[str, float]
+
+TEMPLATE_CACHE: Dict[str, Tuple[int, List[str]]] = {}
+
+HTTP_METHODS = frozenset(["GET", "POST", "PUT", "DELETE", "HEAD", "OPTIONS", "PATCH"])
+LOG_FORMAT_VARIABLE = re.compile(r"\$(\w+)|\$\{(\w+)\}")
+LOG_FORMAT_URL_VARIABLES = frozenset(["request", "request_uri", "uri"])
+HTTP_METHODS_BYTES = frozenset(method.encode() for method in HTTP_METHODS)
+LINE_PATTERN = re.compile(
+    rb"(?:GET|POST|PUT|DELETE|HEAD|OPTIONS|PATCH)\s+([^\s]+).*\s(\d+\.\d+)$"
+)
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+ERROR_RATIO_MIN_LINES = 1000
+URL_QUERY_MODES = ("keep", "strip", "sort")
+URL_ID_SEGMENTS = (
+    (
+        re.compile(
+            r"(?<=/)[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-"
+            r"[0-9a-fA-F]{4}-[0-9a-fA-F]{12}(?=/|$)"
+        ),
+        "{uuid}",
+    ),
+    (re.compile(r"(?<=/)\d+(?=/|$)"), "{id}"),
+    (re.compile(r"(?<=/)[0-9a-fA-F]{16,}(?=/|$)"), "{hash}"),
+)
+URL_CACHE_SIZE = 1 << 16
+OTHER_URL = "other"
+SAMPLING_INTERVAL = 0.005
+PROC_CLEAR_REFS_PATH = "/proc/self/clear_refs"
+PROC_STATUS_PATH = "/proc/self/status"
+REPORT_PLACEHOLDERS = (
+    "table_json",
+    "report_date",
+    "total_entries",
+    "total_request_time",
+    "stage_timings",
+    "report_pages",
+)
+REPORT_PLACEHOLDER_PATTERN = re.compile(r"\$(" + "|".join(REPORT_PLACEHOLDERS) + r")\b")
+REPORT_WRITE_BATCH = 1000
+CHECKPOINT_HEAD_SIZE = 4096
+READ_CHUNK_SIZE = 1 << 20
+DECOMPRESS_QUEUE_SIZE = 16
+
+
+REPORT_QUANTILES: Dict[str, float] = {
+    "time_med": 0.5,
+    "time_p90": 0.9,
+    "time_p95": 0.95,
+    "time_p99": 0.99,
+}
+REPORT_COLUMNS = [
+    "url",
+    "count",
+    "count_perc",
+    "time_sum",
+    "time_sum_error",
+    "time_perc",
+    "time_avg",
+    "time_max",
+    *REPORT_QUANTILES,
+]
+
+
+class ExactQuantiles:
+    __slots__ = ("samples",)
+
+    SELECTION_THRESHOLD = 64
+
+    def __init__(self) -> None:
+        self.samples = array("d")
+
+    def add(self, value: float) -> None:
+        self.samples.append(value)
+
+    def merge(self, other: "ExactQuantiles") -> None:
+        self.samples.extend(other.samples)
+
+    def quantiles(self, qs: Iterable[float]) -> List[float]:
+        qs = list(qs)
+
+        if not self.samples:
+            return [0.0 for _ in qs]
+
+        size = len(self.samples)
+        positions = [q * (size - 1) for q in qs]
+        ranks = sorted(
+            {
+                min(int(position) + offset, size - 1)
+                for position in positions
+                for offset in (0, 1)
+            }
+        )
+
+        if np is not None and size >= self.SELECTION_THRESHOLD:
+            selected = np.partition(np.frombuffer(self.samples), ranks)
+            order_stats = {rank: float(selected[rank]) for rank in ranks}
+        else:
+            ordered = sorted(self.samples)
+            order_stats = {rank: ordered[rank] for rank in ranks}
+
+        result = []
+
+        for position in positions:
+            idx = int(position)
+            fraction = position - idx
+
+            if fraction:
+                result.append(
+                    order_stats[idx] * (1 - fraction) + order_stats[idx + 1] * fraction
+                )
+            else:
+                result.append(order_stats[idx])
+
+        return result
+
+    def median(self) -> float:
+        return self.quantiles([0.5])[0]
+
+
+class HistogramQuantiles:
+    # Log-scale buckets: every value in (gamma ** (i - 1), gamma ** i] is
+    # represented by one counter, so quantiles are within RELATIVE_ACCURACY
+    # of the true sample. Past MAX_BUCKETS the lowest buckets are collapsed,
+    # which only degrades the lowest quantiles and keeps memory constant.
+    __slots__ = ("buckets", "zero_count", "count")
+
+    RELATIVE_ACCURACY = 0.01
+    MIN_VALUE = 1e-6
+    MAX_BUCKETS = 2048
+    GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    LOG_GAMMA = math.log(GAMMA)
+
+    def __init__(self) -> None:
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+
+        if value < self.MIN_VALUE:
+            self.zero_count += 1
+            return
+
+        idx = math.ceil(math.log(value) / self.LOG_GAMMA)
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+
+        if len(self.buckets) > self.MAX_BUCKETS:
+            self._collapse()
+
+    def merge(self, other: "HistogramQuantiles") -> None:
+        self.count += other.count
+        self.zero_count += other.zero_count
+
+        for idx, bucket_count in other.buckets.items():
+            self.buckets[idx] = self.buckets.get(idx, 0) + bucket_count
+
+        if len(self.buckets) > self.MAX_BUCKETS:
+            self._collapse()
+
+    def _collapse(self) -> None:
+        indexes = sorted(self.buckets)
+        extra = len(indexes) - self.MAX_BUCKETS
+        target = indexes[extra]
+
+        for idx in indexes[:extra]:
+            self.buckets[target] += self.buckets.pop(idx)
+
+    def quantiles(self, qs: Iterable[float]) -> List[float]:
+        if not self.count:
+            return [0.0 for _ in qs]
+
+        indexes = sorted(self.buckets)
+        result = []
+
+        for q in qs:
+            position = q * (self.count - 1)
+            rank = int(position)
+            fraction = position - rank
+            value = self._rank_value(indexes, rank)
+
+            if fraction:
+                upper = self._rank_value(indexes, min(rank + 1, self.count - 1))
+                value = value * (1 - fraction) + upper * fraction
+
+            result.append(value)
+
+        return result
+
+    def _rank_value(self, indexes: List[int], rank: int) -> float:
+        seen = self.zero_count
+
+        if rank < seen:
+            return 0.0
+
+        for idx in indexes:
+            seen += self.buckets[idx]
+            if seen > rank:
+                return 2 * self.GAMMA**idx / (self.GAMMA + 1)
+
+        return 0.0
+
+    def median(self) -> float:
+        return self.quantiles([0.5])[0]
+
+
+class TDigestQuantiles:
+    # Merging t-digest with the k1 scale function: centroids near the tails
+    # are kept small, the rank error of any quantile stays well under
+    # 1 / COMPRESSION and the number of centroids never exceeds ~COMPRESSION.
+    __slots__ = ("means", "weights", "buffer", "count", "min", "max")
+
+    COMPRESSION = 100
+    BUFFER_SIZE = 500
+
+    def __init__(self) -> None:
+        self.means = array("d")
+        self.weights = array("d")
+        self.buffer = array("d")
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float) -> None:
+        self.buffer.append(value)
+        self.count += 1
+
+        if value < self.min:
+            self.min = value
+
+        if value > self.max:
+            self.max = value
+
+        if len(self.buffer) >= self.BUFFER_SIZE:
+            self._compress()
+
+    def merge(self, other: "TDigestQuantiles") -> None:
+        if not other.count:
+            return
+
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        points = list(zip(other.means, other.weights))
+        points.extend((value, 1.0) for value in other.buffer)
+        self._compress(points)
+
+    def _k_to_q(self, k: float) -> float:
+        return (math.sin(2 * math.pi * k / self.COMPRESSION) + 1) / 2
+
+    def _q_to_k(self, q: float) -> float:
+        return self.COMPRESSION * math.asin(2 * q - 1) / (2 * math.pi)
+
+    def _compress(self, points: Optional[List[Tuple[float, float]]] = None) -> None:
+        merged = list(zip(self.means, self.weights))
+        merged.extend((value, 1.0) for value in self.buffer)
+        merged.extend(points or [])
+
+        if not merged:
+            return
+
+        merged.sort()
+        total = sum(weight for _, weight in merged)
+
+        means = array("d")
+        weights = array("d")
+
+        current_mean, current_weight = merged[0]
+        cumulative = 0.0
+        q_limit = self._k_to_q(self._q_to_k(0.0) + 1)
+
+        for mean, weight in merged[1:]:
+            if (cumulative + current_weight + weight) / total <= q_limit:
+                current_weight += weight
+                current_mean += (mean - current_mean) * weight / current_weight
+            else:
+                means.append(current_mean)
+                weights.append(current_weight)
+                cumulative += current_weight
+                q_limit = self._k_to_q(self._q_to_k(cumulative / total) + 1)
+                current_mean, current_weight = mean, weight
+
+        means.append(current_mean)
+        weights.append(current_weight)
+
+        self.means = means
+        self.weights = weights
+        self.buffer = array("d")
+
+    def quantiles(self, qs: Iterable[float]) -> List[float]:
+        if not self.count:
+            return [0.0 for _ in qs]
+
+        if self.buffer:
+            self._compress()
+
+        centers = []
+        cumulative = 0.0
+
+        for weight in self.weights:
+            centers.append(cumulative + weight / 2)
+            cumulative += weight
+
+        result = []
+
+        for q in qs:
+            rank = q * self.count
+
+            if rank <= centers[0]:
+                value = self.min + (self.means[0] - self.min) * rank / centers[0]
+            elif rank >= centers[-1]:
+                tail = self.count - centers[-1]
+                value = self.max - (self.max - self.means[-1]) * (
+                    (self.count - rank) / tail if tail else 0.0
+                )
+            else:
+                idx = 1
+                while centers[idx] < rank:
+                    idx += 1
+
+                fraction = (rank - centers[idx - 1]) / (centers[idx] - centers[idx - 1])
+                value = (
+                    self.means[idx - 1]
+                    + (self.means[idx] - self.means[idx - 1]) * fraction
+                )
+
+            result.append(min(max(value, self.min), self.max))
+
+        return result
+
+    def median(self) -> float:
+        return self.quantiles([0.5])[0]
+
+
+QUANTILE_BACKENDS: Dict = {
+    "exact": ExactQuantiles,
+    "histogram": HistogramQuantiles,
+    "tdigest": TDigestQuantiles,
+}
+
+
+class UrlAggregate:
+    __slots__ = ("count", "time_sum", "time_max", "quantiles")
+
+    error = 0.0
+
+    def __init__(self, quantiles) -> None:
+        self.count = 0
+        self.time_sum = 0.0
+        self.time_max = 0.0
+        self.quantiles = quantiles
+
+    def add(self, request_time: float) -> None:
+        self.count += 1
+        self.time_sum += request_time
+
+        if request_time > self.time_max:
+            self.time_max = request_time
+
+        self.quantiles.add(request_time)
+
+    def merge(self, other: "UrlAggregate") -> None:
+        self.count += other.count
+        self.time_sum += other.time_sum
+
+        if other.time_max > self.time_max:
+            self.time_max = other.time_max
+
+        self.quantiles.merge(other.quantiles)
+
+
+class HeavyHitterAggregate(UrlAggregate):
+    # Space-Saving entry: time_sum is the request time observed since the URL
+    # was (re)inserted, error bounds what it may have accumulated while it was
+    # evicted, so the true time_sum lies in [time_sum, time_sum + error].
+    __slots__ = ("error",)
+
+    def __init__(self, quantiles, error: float = 0.0) -> None:
+        super().__init__(quantiles)
+        self.error = error
+
+    def merge(self, other: UrlAggregate) -> None:
+        super().merge(other)
+        self.error += other.error
+
+    def absorb(self, other: UrlAggregate) -> None:
+        self.count += other.count
+        self.time_sum += other.time_sum
+
+        if other.time_max > self.time_max:
+            self.time_max = other.time_max
+
+        if type(self.quantiles) is type(other.quantiles):
+            self.quantiles.merge(other.quantiles)
+        else:
+            for value in other.quantiles.samples:
+                self.quantiles.add(value)
+
+
+def to_heavy_hitter(aggregate: UrlAggregate) -> HeavyHitterAggregate:
+    if isinstance(aggregate, HeavyHitterAggregate):
+        return aggregate
+
+    converted = HeavyHitterAggregate(aggregate.quantiles)
+    converted.count = aggregate.count
+    converted.time_sum = aggregate.time_sum
+    converted.time_max = aggregate.time_max
+
+    return converted
+
+
+def _reset_peak_rss() -> bool:
+    # Linux only: "5" resets VmHWM to the current rss, so the next read
+    # reports the peak since this call instead of since process start.
+    try:
+        with open(PROC_CLEAR_REFS_PATH, mode="w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        return False
+
+    return True
+
+
+def _get_peak_rss_mb() -> Optional[float]:
+    try:
+        with open(PROC_STATUS_PATH, encoding="utf-8") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    return None
+
+
+def _get_resource_usage() -> Tuple[float, float, float]:
+    cpu_time = time.process_time()
+
+    if resource is None:
+        return cpu_time, 0.0, 0.0
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (
+        cpu_time + children.ru_utime + children.ru_stime,
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        children.ru_maxrss / 1024,
+    )
+
+
+class PipelineStats:
+    __slots__ = ("stages",)
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, Dict] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Generator[Dict, None, None]:
+        record: Dict = {}
+        peak_reset = _reset_peak_rss()
+        started = time.perf_counter()
+        cpu_started, _, children_rss_started = _get_resource_usage()
+
+        try:
+            yield record
+        finally:
+            wall_time = time.perf_counter() - started
+            cpu_time, process_rss_mb, children_rss_mb = _get_resource_usage()
+
+            # without a reset only the process lifetime peak is available;
+            # children count only if one that peaked higher exited meanwhile
+            stage_rss_mb = _get_peak_rss_mb() if peak_reset else None
+            peak_rss_mb = max(
+                process_rss_mb if stage_rss_mb is None else stage_rss_mb,
+                children_rss_mb if children_rss_mb > children_rss_started else 0.0,
+            )
+
+            record.update(
+                wall_time=round(wall_time, 6),
+                cpu_time=round(cpu_time - cpu_started, 6),
+                peak_rss_mb=round(peak_rss_mb, 1),
+            )
+
+            for unit in ("lines", "bytes"):
+                if unit in record:
+                    record[f"{unit}_per_sec"] = (
+                        round(record[unit] / wall_time, 1) if wall_time else None
+                    )
+
+            self.stages[name] = record
+
+    def as_dict(self) -> Dict:
+        return {
+            "stages": self.stages,
+            "wall_time": round(sum(r["wall_time"] for r in self.stages.values()), 6),
+            "cpu_time": round(sum(r["cpu_time"] for r in self.stages.values()), 6),
+            "peak_rss_mb": max(
+                (r["peak_rss_mb"] for r in self.stages.values()), default=0.0
+            ),
+        }
+
+
+class SamplingProfiler:
+    __slots__ = ("interval", "samples", "_previous_handler")
+
+    def __init__(self, interval: float = SAMPLING_INTERVAL) -> None:
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._previous_handler = signal.getsignal(signal.SIGPROF)
+
+    def _sample(self, signum, frame) -> None:
+        stack = []
+
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+            frame = frame.f_back
+
+        self.samples[tuple(reversed(stack))] += 1
+
+    def enable(self) -> None:
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def disable(self) -> None:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+
+    def dump_stats(self, stats_path: str) -> None:
+        with open(stats_path, mode="w", encoding="utf-8") as stats_file:
+            for stack, count in self.samples.most_common():
+                stats_file.write(f"{';'.join(stack)} {count}\n")
+
+    def summary(self, top: int) -> str:
+        total = sum(self.samples.values())
+        own: Counter = Counter()
+        cumulative: Counter = Counter()
+
+        for stack, count in self.samples.items():
+            own[stack[-1]] += count
+
+            for function in set(stack):
+                cumulative[function] += count
+
+        lines = [f"{total} samples, {self.interval * 1000:g} ms interval", ""]
+        lines.append(f"{'own':>8} {'cumulative':>10}  function")
+
+        for function, count in own.most_common(top):
+            lines.append(
+                f"{count / total:>8.1%} {cumulative[function] / total:>10.1%}  "
+                f"{function}"
+            )
+
+        return "\n".join(lines) + "\n"
+
+
+PROFILERS: Dict = {
+    "cprofile": cProfile.Profile,
+    "sampling": SamplingProfiler,
+}
+
+
+def get_profile_summary(profiler, top: int) -> str:
+    if isinstance(profiler, SamplingProfiler):
+        return profiler.summary(top)
+
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    return stream.getvalue()
+
+
+def run_profiled(profile: str, report_dir: str, top: int, func, *args) -> None:
+    log = structlog.get_logger()
+
+    profile_prefix = f"{report_dir}/profile-{time.strftime('%Y%m%d-%H%M%S')}"
+    stats_path = f"{profile_prefix}.{'prof' if profile == 'cprofile' else 'folded'}"
+    summary_path = f"{profile_prefix}.txt"
+
+    log.info(message="Starting profiler", profile=profile, stats_path=stats_path)
+
+    profiler = PROFILERS[profile]()
+    profiler.enable()
+
+    try:
+        func(*args)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(stats_path)
+
+        with open(summary_path, mode="w", encoding="utf-8") as summary_file:
+            summary_file.write(get_profile_summary(profiler, top))
+
+        log.info(
+            message="Profile saved", stats_path=stats_path, summary_path=summary_path
+        )
+
+
+class ParseErrorLimitExceeded(Exception):
+    pass
+
+
+class ParseErrors:
+    # Failed line counters of one parse; shards and checkpoints are merged so
+    # the summary and the error ratio always cover the whole parsed range.
+    __slots__ = ("lines", "failed", "samples")
+
+    def __init__(self) -> None:
+        self.lines = 0
+        self.failed = 0
+        self.samples: List[Dict] = []
+
+    def merge(self, other: "ParseErrors") -> None:
+        self.lines += other.lines
+        self.failed += other.failed
+        self.samples.extend(other.samples)
 
 
 def _handle_exception(ex_type, _, traceback) -> None:
@@ -38,16 +816,22 @@ def _handle_exception(ex_type, _, traceback) -> None:
     )
 
 
-def _configure_logger(app_log_file: Optional[str]) -> None:
+def _configure_logger(app_log_file: Optional[str], log_level: str = "DEBUG") -> None:
     handlers: List[logging.Handler] = [logging.StreamHandler()]
 
     if app_log_file:
         handlers.append(logging.FileHandler(app_log_file))
 
-    logging.basicConfig(level=logging.DEBUG, format="%(message)s", handlers=handlers)
+    logging.basicConfig(
+        level=getattr(logging, log_level),
+        format="%(message)s",
+        handlers=handlers,
+        force=True,
+    )
 
     structlog.configure(
         processors=[
+            structlog.stdlib.filter_by_level,
             structlog.stdlib.add_log_level,
             structlog.processors.TimeStamper(fmt="iso", utc=True),
             structlog.processors.StackInfoRenderer(),
@@ -144,18 +928,21 @@ def get_log_files(dir_path: Optional[str]) -> List[str]:
         return []
 
 
-def search_latest(log_files: List[str]) -> LogFile:
+def search_latest(
+    log_files: List[str], search_pattern: str = LOG_NAME_PATTERN
+) -> LogFile:
     log = structlog.get_logger()
     log.info(message="Starting search latest log file", log_files=log_files)
 
-    search_pattern = r"^nginx-access-ui\.log-(?P<date>\d{8})(?:\.gz)?$"
     log.debug(message="Configure search regex pattern", search_pattern=search_pattern)
 
+    compiled_pattern = re.compile(search_pattern)
+
     latest_date = "00000000"
     latest_log = ""
 
     for log_name in log_files:
-        name_match = re.search(search_pattern, log_name)
+        name_match = compiled_pattern.search(log_name)
         if name_match:
             date = name_match.group("date")
             log.debug(message="Name of log file matched", log_name=log_name, date=date)
@@ -177,7 +964,44 @@ def search_latest(log_files: List[str]) -> LogFile:
     log.info(
         message="Searching finished", latest_log=latest_log, latest_date=latest_date
     )
-    return LogFile(latest_log, latest_date, ".gz" if ".gz" in latest_log else ".log")
+    extention = os.path.splitext(latest_log)[1]
+    return LogFile(
+        latest_log, latest_date, extention if extention in CODECS else ".log"
+    )
+
+
+def search_logs(
+    log_files: List[str], search_pattern: str = LOG_NAME_PATTERN
+) -> List[LogFile]:
+    log = structlog.get_logger()
+    log.info(message="Starting search all log files", log_files=log_files)
+
+    compiled_pattern = re.compile(search_pattern)
+    found_logs: Dict[str, LogFile] = {}
+
+    for log_name in log_files:
+        name_match = compiled_pattern.search(log_name)
+
+        if not name_match:
+            continue
+
+        date = name_match.group("date")
+
+        if date in found_logs:
+            log.debug(
+                message="Log file for this date already found, skipped",
+                log_name=log_name,
+                date=date,
+            )
+            continue
+
+        extention = os.path.splitext(log_name)[1]
+        found_logs[date] = LogFile(
+            log_name, date, extention if extention in CODECS else ".log"
+        )
+
+    log.info(message="Searching finished", found_logs=len(found_logs))
+    return [found_logs[date] for date in sorted(found_logs)]
 
 
 def get_log_path(log_name: str, log_dir: Optional[str]) -> Optional[str]:
@@ -195,136 +1019,1471 @@ def get_log_path(log_name: str, log_dir: Optional[str]) -> Optional[str]:
     return f"{log_dir}/{log_name}"
 
 
-def entries_parser(log_file: IO[str]) -> Generator[Dict, None, None]:
-    log = structlog.get_logger()
+@functools.lru_cache(maxsize=URL_CACHE_SIZE)
+def decode_url(url: bytes) -> str:
+    # keyed on the raw bytes, so repeated urls share one str instead of
+    # decoding a new one for every line
+    return url.decode("utf-8", "replace")
 
-    parsing_pattern = r"(?:GET|POST|PUT|DELETE|HEAD|OPTIONS|PATCH)\s+(?P<url>[^\s]+).*?\s+(?P<request_time>\d+\.\d+)$"
-    log.debug(message="Configure parsing pattern", parsing_patter=parsing_pattern)
 
-    idx = 0
-    for line in log_file:
-        idx += 1
-        line_match = re.search(parsing_pattern, line)
+def parse_line_regex(line: bytes) -> Optional[LogEntry]:
+    line_match = LINE_PATTERN.search(line)
 
-        if not line_match:
-            log.error(
-                message="Failed to parse line",
-                log_file=log_file.name,
-                line_index=idx,
-                line=line,
-            )
-            yield {}
-        else:
-            yield line_match.groupdict()
+    if not line_match:
+        return None
 
+    url, request_time = line_match.groups()
+    return decode_url(url), float(request_time)
 
-def parse_entries(parser: Generator[Dict, None, None]) -> ParserOutput:
-    log = structlog.get_logger()
-    log.info(message="Starting log entries parsing")
 
-    entries: Dict = {}
-    total: Dict = {"entries": 0, "request_time": 0.0}
+def parse_line_ui_short(line: bytes) -> Optional[LogEntry]:
+    request_start = line.find(b'"') + 1
+    request_end = line.find(b'"', request_start)
 
-    for entry in parser:
-        if not entry:
-            continue
+    if not request_start or request_end < 0:
+        return None
 
-        url = entry["url"]
-        request_time = float(entry["request_time"])
+    request = line[request_start:request_end].split(b" ", 2)
 
-        if url not in entries:
-            entries[url] = []
+    if len(request) < 2 or request[0] not in HTTP_METHODS_BYTES or not request[1]:
+        return None
 
-        entries[url].append(request_time)
+    # same grammar as LINE_PATTERN: digits, a dot and digits, which float()
+    # alone would widen to signs, exponents, inf and surrounding whitespace
+    request_time = line[line.rfind(b" ") + 1 :].removesuffix(b"\n")
+    whole, dot, fraction = request_time.partition(b".")
 
-        total["entries"] += 1
-        total["request_time"] += request_time
+    if not (dot and whole.isdigit() and fraction.isdigit()):
+        return None
 
-    log.info(message="Finished log entries parsing")
-    return ParserOutput(entries, total)
+    return decode_url(request[1]), float(request_time)
 
 
-def calculate_metrics(etnries: Dict, total: Dict) -> List[Dict]:
-    log = structlog.get_logger()
+LINE_PARSERS: Dict = {
+    "regex": parse_line_regex,
+    "ui_short": parse_line_ui_short,
+}
 
-    log.info(message="Calculating metrics", total=total)
 
-    metrics: List[Dict] = []
+def _compile_log_format_literal(literal: str) -> str:
+    return r"\s+".join(re.escape(part) for part in re.split(r"\s+", literal))
 
-    for url in etnries:
-        entry_metrics: Dict = {
-            "url": url,
-            "count": len(etnries[url]),
-            "count_perc": len(etnries[url]) / total["entries"] * 100,
-            "time_sum": sum(etnries[url]),
-            "time_perc": sum(etnries[url]) / total["request_time"] * 100,
-            "time_avg": statistics.mean(etnries[url]),
-            "time_max": max(etnries[url]),
-            "time_med": statistics.median(etnries[url]),
-        }
 
-        metrics.append(entry_metrics)
+def compile_log_format(log_format: str) -> Optional[re.Pattern]:
+    log = structlog.get_logger()
+    log.info(message="Compiling log format", log_format=log_format)
 
-    return metrics
+    tokens = LOG_FORMAT_VARIABLE.split(log_format)
+    literals = tokens[::3]
+    variables = [plain or braced for plain, braced in zip(tokens[1::3], tokens[2::3])]
 
+    pattern = _compile_log_format_literal(literals[0])
+    captured = set()
 
-def is_report_dir_exists(report_dir: Optional[str]):
-    log = structlog.get_logger()
+    for variable, literal in zip(variables, literals[1:]):
+        stop = literal[:1]
 
-    log.info(message="Checking report dir exists", report_dir=report_dir)
+        if not stop:
+            field, url_field = ".*", r"\S+"
+        elif stop.isspace():
+            field, url_field = r"\S*", r"\S+"
+        else:
+            field = f"[^{re.escape(stop)}]*"
+            url_field = f"[^\\s{re.escape(stop)}]+"
+
+        if variable == "request_time" and "request_time" not in captured:
+            pattern += r"(?P<request_time>\d+(?:\.\d+)?)"
+            captured.add("request_time")
+        elif variable in LOG_FORMAT_URL_VARIABLES and "url" not in captured:
+            if variable == "request":
+                methods = "|".join(sorted(HTTP_METHODS))
+                pattern += rf"(?:{methods})\s+(?P<url>{url_field}){field}"
+            else:
+                pattern += f"(?P<url>{url_field}){field}"
+
+            captured.add("url")
+        else:
+            pattern += field
 
-    if not report_dir:
-        log.debug(
-            message="Report dir path empty or None, returned False",
-            report_dir=report_dir,
+        pattern += _compile_log_format_literal(literal)
+
+    if captured != {"url", "request_time"}:
+        log.error(
+            message="Log format must contain $request_time and one of "
+            "$request, $request_uri or $uri",
+            log_format=log_format,
         )
-        return False
+        return None
 
-    return os.path.exists(report_dir)
+    log.debug(message="Log format compiled", parsing_pattern=pattern)
+    return re.compile(pattern.encode("utf-8") + b"$")
 
 
-def sort_metrics(metrics: List[Dict]) -> List[Dict]:
-    log = structlog.get_logger()
+@functools.lru_cache(maxsize=None)
+def get_line_parser(log_parser: str = "regex", log_format: Optional[str] = None):
+    if not log_format:
+        return LINE_PARSERS[log_parser]
 
-    log.info(message='Sorting metrics by "time_sum"')
+    pattern = compile_log_format(log_format)
 
-    metrics.sort(reverse=True, key=lambda d: (d.get("time_sum", 0.0), 0))
+    if pattern is None:
+        return None
 
-    log.info(message="Metrics sorted")
+    match_line = pattern.match
 
-    return metrics
+    def parse_line_log_format(line: bytes) -> Optional[LogEntry]:
+        line_match = match_line(line)
 
+        if not line_match:
+            return None
 
-def truncate_metrics(metrics: List[Dict], size: int) -> List[Dict]:
-    log = structlog.get_logger()
+        url, request_time = line_match.group("url", "request_time")
+        return decode_url(url), float(request_time)
 
-    log.info(
-        message="Truncating metrics", current_size=len(metrics), truncate_size=size
-    )
+    return parse_line_log_format
 
-    return metrics[0:size]
 
+@functools.lru_cache
+def get_url_normalizer(
+    url_query: str = "keep",
+    url_collapse_ids: bool = False,
+    url_rewrite_rules: Tuple = (),
+) -> Optional[Callable[[str], str]]:
+    if url_query == "keep" and not url_collapse_ids and not url_rewrite_rules:
+        return None
 
-def get_json_metrics(metrics: List[Dict]) -> str:
-    log = structlog.get_logger()
+    rewrite_rules = [
+        (re.compile(pattern), replacement) for pattern, replacement in url_rewrite_rules
+    ]
 
-    log.info(message="Converting metrics to json")
+    def normalize_url(url: str) -> str:
+        path, separator, query = url.partition("?")
 
-    return json.dumps(metrics)
+        if url_collapse_ids:
+            for pattern, placeholder in URL_ID_SEGMENTS:
+                path = pattern.sub(placeholder, path)
 
+        if url_query == "strip" or not separator:
+            url = path
+        elif url_query == "sort":
+            url = f"{path}?{'&'.join(sorted(query.split('&')))}"
+        else:
+            url = f"{path}?{query}"
 
-def get_report_template(template_path: str) -> Optional[str]:
-    log = structlog.get_logger()
+        for pattern, replacement in rewrite_rules:
+            url = pattern.sub(replacement, url)
 
-    log.info(message="Getting report template content")
+        return url
 
-    try:
-        return open(template_path, encoding="utf-8").read()
-    except FileNotFoundError:
-        log.error(
-            message="Report template file not found",
-            template_path=template_path,
-        )
+    return functools.lru_cache(maxsize=URL_CACHE_SIZE)(normalize_url)
+
+
+def read_chunks(
+    log_file: io.BufferedIOBase,
+    limit: Optional[int] = None,
+    chunk_size: int = READ_CHUNK_SIZE,
+) -> Generator[bytes, None, None]:
+    while limit is None or limit > 0:
+        chunk = log_file.read(chunk_size if limit is None else min(chunk_size, limit))
+
+        if not chunk:
+            break
+
+        if limit is not None:
+            limit -= len(chunk)
+
+        yield chunk
+
+
+def split_lines(chunks: Iterable[bytes]) -> Generator[bytes, None, None]:
+    remainder = b""
+
+    for chunk in chunks:
+        lines = chunk.split(b"\n")
+        lines[0] = remainder + lines[0]
+        remainder = lines.pop()
+
+        yield from lines
+
+    if remainder:
+        yield remainder
+
+
+def threaded_chunks(
+    chunks: Iterable[bytes], queue_size: int = DECOMPRESS_QUEUE_SIZE
+) -> Generator[bytes, None, None]:
+    chunks_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                chunks_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def produce() -> None:
+        try:
+            for chunk in chunks:
+                if not put(chunk):
+                    return
+        except BaseException as ex:
+            put(ex)
+        else:
+            put(None)
+
+    producer = threading.Thread(target=produce, name="decompress", daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item = chunks_queue.get()
+
+            if item is None:
+                break
+
+            if isinstance(item, BaseException):
+                raise item
+
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+
+
+def get_gzip_command(gzip_command: Optional[str]) -> Optional[List[str]]:
+    log = structlog.get_logger()
+
+    if not gzip_command:
+        return None
+
+    candidates = ["pigz", "igzip"] if gzip_command == "auto" else [gzip_command]
+
+    for candidate in candidates:
+        command_path = shutil.which(candidate)
+
+        if command_path:
+            log.debug(message="External gzip decompressor found", command=command_path)
+            return [command_path, "-d", "-c"]
+
+    log.warning(
+        message="External gzip decompressor not found, using gzip module",
+        gzip_command=gzip_command,
+    )
+    return None
+
+
+def command_chunks(
+    command: List[str], chunk_size: int = READ_CHUNK_SIZE
+) -> Generator[bytes, None, None]:
+    with subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    ) as process:
+        stdout = cast(io.BufferedIOBase, process.stdout)
+        yield from read_chunks(stdout, chunk_size=chunk_size)
+
+        _, stderr = process.communicate()
+
+        if process.returncode:
+            raise gzip.BadGzipFile(stderr.decode("utf-8", "replace").strip())
+
+
+def codec_chunks(
+    log_path: str, extention: str = ".gz", chunk_size: int = READ_CHUNK_SIZE
+) -> Generator[bytes, None, None]:
+    with CODECS[extention](log_path, mode="rb") as log_file:
+        yield from read_chunks(log_file, chunk_size=chunk_size)
+
+
+def decompress_chunks(
+    log_path: str,
+    extention: str = ".gz",
+    threaded: bool = True,
+    gzip_command: Optional[str] = None,
+) -> Generator[bytes, None, None]:
+    log = structlog.get_logger()
+
+    command = get_gzip_command(gzip_command) if extention == ".gz" else None
+    log.info(
+        message="Starting log decompression",
+        log_path=log_path,
+        extention=extention,
+        threaded=threaded,
+        command=command,
+    )
+
+    if command:
+        chunks: Iterable[bytes] = command_chunks([*command, log_path])
+    else:
+        chunks = codec_chunks(log_path, extention)
+
+    if threaded:
+        chunks = threaded_chunks(chunks)
+
+    started = time.perf_counter()
+    decompressed = 0
+
+    for chunk in chunks:
+        decompressed += len(chunk)
+        yield chunk
+
+    elapsed = time.perf_counter() - started
+    log.info(
+        message="Log decompression finished",
+        log_path=log_path,
+        decompressed_bytes=decompressed,
+        seconds=round(elapsed, 3),
+        mb_per_sec=round(decompressed / (1 << 20) / elapsed, 1) if elapsed else None,
+    )
+
+
+def entries_parser(
+    log_file: Iterable[bytes],
+    log_parser: str = "regex",
+    log_format: Optional[str] = None,
+    log_name: Optional[str] = None,
+    error_samples: int = 10,
+    max_error_ratio: Optional[float] = None,
+    errors: Optional[ParseErrors] = None,
+    start: int = 0,
+) -> Generator[Optional[LogEntry], None, None]:
+    log = structlog.get_logger()
+    log_name = log_name or getattr(log_file, "name", None)
+    errors = errors if errors is not None else ParseErrors()
+
+    parse_line = get_line_parser(log_parser, log_format)
+    log.debug(
+        message="Configure line parser", log_parser=log_parser, log_format=log_format
+    )
+
+    position = start
+
+    for line in log_file:
+        offset = position
+        position += len(line) + 1
+        errors.lines += 1
+        entry = parse_line(line)
+
+        if entry is None:
+            errors.failed += 1
+
+            if len(errors.samples) < error_samples:
+                errors.samples.append(
+                    {"offset": offset, "line": line.decode("utf-8", "replace")}
+                )
+
+            if (
+                max_error_ratio is not None
+                and errors.lines >= ERROR_RATIO_MIN_LINES
+                and errors.failed > max_error_ratio * errors.lines
+            ):
+                log.error(
+                    message="Parse error ratio exceeded, parsing aborted",
+                    log_file=log_name,
+                    lines=errors.lines,
+                    failed=errors.failed,
+                    max_error_ratio=max_error_ratio,
+                    samples=errors.samples,
+                )
+                raise ParseErrorLimitExceeded(log_name)
+
+        yield entry
+
+
+def report_parse_errors(
+    errors: Optional[ParseErrors],
+    log_name: Optional[str] = None,
+    error_samples: int = 10,
+    max_error_ratio: Optional[float] = None,
+) -> None:
+    log = structlog.get_logger()
+
+    if errors is None or not errors.failed:
+        return
+
+    errors.samples = sorted(errors.samples, key=lambda sample: sample["offset"])[
+        :error_samples
+    ]
+    error_ratio = errors.failed / errors.lines
+    log.warning(
+        message="Failed to parse lines",
+        log_file=log_name,
+        lines=errors.lines,
+        failed=errors.failed,
+        error_ratio=round(error_ratio, 6),
+        samples=errors.samples,
+    )
+
+    if max_error_ratio is not None and error_ratio > max_error_ratio:
+        log.error(
+            message="Parse error ratio exceeded",
+            log_file=log_name,
+            error_ratio=round(error_ratio, 6),
+            max_error_ratio=max_error_ratio,
+        )
+        raise ParseErrorLimitExceeded(log_name)
+
+
+def get_tail_aggregate(quantile_backend: str = "exact") -> HeavyHitterAggregate:
+    if quantile_backend == "exact":
+        return HeavyHitterAggregate(HistogramQuantiles())
+
+    return HeavyHitterAggregate(QUANTILE_BACKENDS[quantile_backend]())
+
+
+def prune_heavy_hitters(
+    entries: Dict, capacity: int, tail: HeavyHitterAggregate
+) -> float:
+    log = structlog.get_logger()
+
+    kept = heapq.nlargest(
+        capacity, entries, key=lambda url: entries[url].time_sum + entries[url].error
+    )
+    kept_urls = set(kept)
+    threshold = 0.0
+
+    for url in [url for url in entries if url not in kept_urls]:
+        aggregate = entries.pop(url)
+        threshold = max(threshold, aggregate.time_sum + aggregate.error)
+        tail.absorb(aggregate)
+
+    log.debug(message="Heavy hitters pruned", kept=len(entries), threshold=threshold)
+    return threshold
+
+
+def parse_entries(
+    parser: Iterable[Optional[LogEntry]],
+    quantile_backend: str = "exact",
+    normalize_url: Optional[Callable[[str], str]] = None,
+    heavy_hitters_capacity: Optional[int] = None,
+) -> ParserOutput:
+    log = structlog.get_logger()
+    log.info(message="Starting log entries parsing", quantile_backend=quantile_backend)
+
+    quantiles_factory = QUANTILE_BACKENDS[quantile_backend]
+
+    entries: Dict = {}
+    total: Dict = {"entries": 0, "request_time": 0.0}
+
+    threshold = 0.0
+    tail = get_tail_aggregate(quantile_backend)
+
+    for entry in parser:
+        if entry is None:
+            continue
+
+        url, request_time = entry
+
+        if normalize_url is not None:
+            url = normalize_url(url)
+
+        aggregate = entries.get(url)
+
+        if aggregate is None:
+            if heavy_hitters_capacity is None:
+                aggregate = entries[url] = UrlAggregate(quantiles_factory())
+            else:
+                if len(entries) >= 2 * heavy_hitters_capacity:
+                    threshold = max(
+                        threshold,
+                        prune_heavy_hitters(entries, heavy_hitters_capacity, tail),
+                    )
+
+                aggregate = entries[url] = HeavyHitterAggregate(
+                    quantiles_factory(), threshold
+                )
+
+        aggregate.add(request_time)
+
+        total["entries"] += 1
+        total["request_time"] += request_time
+
+    if tail.count:
+        tail.error = threshold
+        entries[OTHER_URL] = tail
+        log.info(
+            message="Long tail collapsed into other row",
+            tail_count=tail.count,
+            tail_time_sum=tail.time_sum,
+            max_error=threshold,
+        )
+
+    log.info(message="Finished log entries parsing")
+    return ParserOutput(entries, total)
+
+
+def get_shards(
+    log_path: str, workers: int, start: int = 0, end: Optional[int] = None
+) -> List[Tuple[int, int]]:
+    log = structlog.get_logger()
+
+    log_size = os.path.getsize(log_path) if end is None else end
+    log.info(
+        message="Splitting log into shards",
+        log_path=log_path,
+        start=start,
+        end=log_size,
+        workers=workers,
+    )
+
+    if workers <= 1 or log_size <= start:
+        return [(start, log_size)]
+
+    shard_size = -(-(log_size - start) // workers)
+    bounds = [start]
+
+    with open(log_path, mode="rb") as log_file, mmap.mmap(
+        log_file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        for idx in range(1, workers):
+            shard_start = max(start + idx * shard_size, bounds[-1]) - 1
+            line_end = mapped.find(b"\n", shard_start, log_size)
+            bound = line_end + 1
+
+            if line_end < 0 or bound >= log_size:
+                break
+
+            if bound > bounds[-1]:
+                bounds.append(bound)
+
+    bounds.append(log_size)
+
+    shards = list(zip(bounds[:-1], bounds[1:]))
+    log.debug(message="Log shards configured", shards=shards)
+    return shards
+
+
+def map_lines(
+    log_path: str, start: int = 0, end: Optional[int] = None
+) -> Generator[bytes, None, None]:
+    with open(log_path, mode="rb") as log_file:
+        if not os.fstat(log_file.fileno()).st_size:
+            return
+
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+            end = len(mapped) if end is None else min(end, len(mapped))
+            position = start
+
+            while position < end:
+                window_end = min(position + READ_CHUNK_SIZE, end)
+                line_end = mapped.rfind(b"\n", position, window_end)
+
+                if line_end < 0:
+                    line_end = mapped.find(b"\n", window_end, end)
+
+                if line_end < 0:
+                    yield mapped[position:end]
+                    break
+
+                yield from mapped[position:line_end].split(b"\n")
+                position = line_end + 1
+
+
+def parse_shard(
+    log_path: str, start: int, end: int, options: ParseOptions = ParseOptions()
+) -> ParserOutput:
+    errors = ParseErrors()
+    parser = entries_parser(
+        map_lines(log_path, start, end),
+        options.log_parser,
+        options.log_format,
+        log_path,
+        options.error_samples,
+        options.max_error_ratio,
+        errors,
+        start,
+    )
+    parser_output = parse_entries(
+        parser,
+        options.quantile_backend,
+        get_url_normalizer(
+            options.url_query, options.url_collapse_ids, options.url_rewrite_rules
+        ),
+        options.heavy_hitters_capacity,
+    )
+    return parser_output._replace(errors=errors)
+
+
+def merge_parser_outputs(
+    outputs: Iterable[ParserOutput],
+    heavy_hitters_capacity: Optional[int] = None,
+    quantile_backend: str = "exact",
+) -> ParserOutput:
+    log = structlog.get_logger()
+    log.info(message="Merging parser outputs")
+
+    entries: Dict = {}
+    total: Dict = {"entries": 0, "request_time": 0.0}
+    errors = ParseErrors()
+
+    thresholds = 0.0
+    covered: Dict = {}
+
+    for output in outputs:
+        if output.errors is not None:
+            errors.merge(output.errors)
+
+        threshold = (
+            output.entries[OTHER_URL].error if OTHER_URL in output.entries else 0
+        )
+
+        if threshold:
+            thresholds += threshold
+
+            for url in output.entries:
+                covered[url] = covered.get(url, 0.0) + threshold
+
+        for url, aggregate in output.entries.items():
+            if url not in entries:
+                entries[url] = aggregate
+            else:
+                if isinstance(aggregate, HeavyHitterAggregate):
+                    entries[url] = to_heavy_hitter(entries[url])
+
+                entries[url].merge(aggregate)
+
+        total["entries"] += output.total["entries"]
+        total["request_time"] += output.total["request_time"]
+
+    if thresholds:
+        # outputs parsed without heavy hitters (e.g. older checkpoints) hold
+        # plain aggregates, which have no per-entry error to widen
+        for url, aggregate in entries.items():
+            entries[url] = aggregate = to_heavy_hitter(aggregate)
+            aggregate.error += thresholds - covered.get(url, 0.0)
+
+        entries[OTHER_URL].error = thresholds
+
+    if (
+        heavy_hitters_capacity is not None
+        and len(entries) - (OTHER_URL in entries) > heavy_hitters_capacity
+    ):
+        tail = to_heavy_hitter(
+            entries.pop(OTHER_URL, None) or get_tail_aggregate(quantile_backend)
+        )
+        tail.error = max(
+            tail.error, prune_heavy_hitters(entries, heavy_hitters_capacity, tail)
+        )
+        entries[OTHER_URL] = tail
+
+    log.info(message="Parser outputs merged", total=total)
+    return ParserOutput(entries, total, errors)
+
+
+def parse_log_parallel(
+    log_path: str,
+    workers: int,
+    options: ParseOptions = ParseOptions(),
+    start: int = 0,
+    end: Optional[int] = None,
+) -> ParserOutput:
+    log = structlog.get_logger()
+
+    shards = get_shards(log_path, workers, start, end)
+    log.info(message="Starting parallel log parsing", shards=len(shards))
+
+    if len(shards) == 1:
+        return parse_shard(log_path, *shards[0], options)
+
+    starts, ends = zip(*shards)
+    # a shard can exceed the ratio on its own while the whole log does not,
+    # so the ratio is only checked once the shards are merged
+    shard_options = options._replace(max_error_ratio=None)
+
+    with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+        outputs = executor.map(
+            parse_shard,
+            [log_path] * len(shards),
+            starts,
+            ends,
+            [shard_options] * len(shards),
+        )
+        return merge_parser_outputs(
+            outputs, options.heavy_hitters_capacity, options.quantile_backend
+        )
+
+
+def parse_log(
+    log_path: str,
+    extention: str,
+    options: ParseOptions = ParseOptions(),
+    start: int = 0,
+    end: Optional[int] = None,
+) -> ParserOutput:
+    if extention not in CODECS:
+        parser_output = parse_log_parallel(
+            log_path, options.workers, options, start, end
+        )
+    else:
+        errors = ParseErrors()
+        chunks = decompress_chunks(
+            log_path, extention, options.decompress_thread, options.gzip_command
+        )
+        parser = entries_parser(
+            split_lines(chunks),
+            options.log_parser,
+            options.log_format,
+            log_path,
+            options.error_samples,
+            options.max_error_ratio,
+            errors,
+        )
+        parser_output = parse_entries(
+            parser,
+            options.quantile_backend,
+            get_url_normalizer(
+                options.url_query, options.url_collapse_ids, options.url_rewrite_rules
+            ),
+            options.heavy_hitters_capacity,
+        )._replace(errors=errors)
+
+    report_parse_errors(
+        parser_output.errors, log_path, options.error_samples, options.max_error_ratio
+    )
+    return parser_output
+
+
+def get_checkpoint_path(checkpoint_dir: Optional[str], log_name: str) -> Optional[str]:
+    log = structlog.get_logger()
+
+    log.info(
+        message="Getting checkpoint path",
+        checkpoint_dir=checkpoint_dir,
+        log_name=log_name,
+    )
+
+    if not checkpoint_dir:
+        log.debug(
+            message="Checkpoint dir path empty or None, returned None",
+            checkpoint_dir=checkpoint_dir,
+        )
+        return None
+
+    return f"{checkpoint_dir}/{log_name}.checkpoint"
+
+
+def load_checkpoint(checkpoint_path: str) -> Optional[Checkpoint]:
+    log = structlog.get_logger()
+
+    log.info(message="Loading checkpoint", checkpoint_path=checkpoint_path)
+
+    try:
+        with open(checkpoint_path, mode="rb") as checkpoint_file:
+            checkpoint = pickle.load(checkpoint_file)
+    except FileNotFoundError:
+        log.info(message="Checkpoint not found", checkpoint_path=checkpoint_path)
+        return None
+    except (pickle.UnpicklingError, EOFError, AttributeError, ValueError, TypeError):
+        log.error(
+            message="Checkpoint is corrupted and ignored",
+            checkpoint_path=checkpoint_path,
+        )
+        return None
+
+    if not isinstance(checkpoint, Checkpoint):
+        log.error(
+            message="Checkpoint has unexpected format and ignored",
+            checkpoint_path=checkpoint_path,
+        )
+        return None
+
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_path: str, checkpoint: Checkpoint) -> None:
+    log = structlog.get_logger()
+
+    log.info(
+        message="Saving checkpoint",
+        checkpoint_path=checkpoint_path,
+        offset=checkpoint.offset,
+    )
+
+    temp_path = f"{checkpoint_path}.tmp"
+
+    with open(temp_path, mode="wb") as checkpoint_file:
+        pickle.dump(checkpoint, checkpoint_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.replace(temp_path, checkpoint_path)
+
+
+def get_complete_size(log_path: str) -> int:
+    with open(log_path, mode="rb") as log_file:
+        if not os.fstat(log_file.fileno()).st_size:
+            return 0
+
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return mapped.rfind(b"\n") + 1
+
+
+def get_head_hash(log_path: str, size: int) -> str:
+    with open(log_path, mode="rb") as log_file:
+        head = log_file.read(min(size, CHECKPOINT_HEAD_SIZE))
+
+    return hashlib.sha256(head).hexdigest()
+
+
+def parse_log_incremental(
+    log_path: str,
+    checkpoint_path: str,
+    options: ParseOptions = ParseOptions(),
+    record: Optional[Dict] = None,
+) -> ParserOutput:
+    log = structlog.get_logger()
+
+    checkpoint = load_checkpoint(checkpoint_path)
+    log_stat = os.stat(log_path)
+    parse_key = get_parse_key(options)
+
+    start = 0
+    outputs = []
+
+    if (
+        checkpoint
+        and checkpoint.log_path == log_path
+        and checkpoint.inode == log_stat.st_ino
+        and checkpoint.offset <= log_stat.st_size
+        and checkpoint.parse_key == parse_key
+        and checkpoint.head_hash == get_head_hash(log_path, checkpoint.offset)
+    ):
+        start = checkpoint.offset
+        outputs.append(checkpoint.parser_output)
+    elif checkpoint:
+        log.warning(
+            message="Checkpoint does not match log file, parsing from start",
+            log_path=log_path,
+            checkpoint_path=checkpoint_path,
+        )
+
+    end = get_complete_size(log_path)
+    log.info(message="Parsing appended log data", start=start, end=end)
+
+    appended = parse_log_parallel(log_path, options.workers, options, start, end)
+    outputs.append(appended)
+
+    if record is not None:
+        record["lines"] = appended.total["entries"]
+        record["bytes"] = end - start
+
+    parser_output = merge_parser_outputs(
+        outputs, options.heavy_hitters_capacity, options.quantile_backend
+    )
+    report_parse_errors(
+        parser_output.errors, log_path, options.error_samples, options.max_error_ratio
+    )
+
+    save_checkpoint(
+        checkpoint_path,
+        Checkpoint(
+            log_path,
+            log_stat.st_ino,
+            end,
+            parse_key,
+            get_head_hash(log_path, end),
+            parser_output,
+        ),
+    )
+
+    return parser_output
+
+
+def get_parse_key(options: ParseOptions = ParseOptions()) -> Tuple:
+    return (
+        options.log_parser,
+        options.log_format,
+        options.quantile_backend,
+        options.url_query,
+        options.url_collapse_ids,
+        options.url_rewrite_rules,
+        options.heavy_hitters_capacity,
+    )
+
+
+def get_log_fingerprint(log_path: str, options: ParseOptions = ParseOptions()) -> Tuple:
+    log_stat = os.stat(log_path)
+
+    return (
+        os.path.abspath(log_path),
+        log_stat.st_size,
+        log_stat.st_mtime_ns,
+        *get_parse_key(options),
+    )
+
+
+def get_cache_path(cache_dir: str, fingerprint: Tuple) -> str:
+    digest = hashlib.sha256(repr(fingerprint).encode()).hexdigest()
+    return f"{cache_dir}/{digest}.cache"
+
+
+def load_cached_output(cache_path: str, fingerprint: Tuple) -> Optional[ParserOutput]:
+    log = structlog.get_logger()
+
+    try:
+        with open(cache_path, mode="rb") as cache_file:
+            cache_entry = pickle.load(cache_file)
+    except FileNotFoundError:
+        log.info(message="Parse cache miss", cache_path=cache_path)
+        return None
+    except (pickle.UnpicklingError, EOFError, AttributeError, ValueError, TypeError):
+        log.error(message="Parse cache entry is corrupted", cache_path=cache_path)
+        return None
+
+    if (
+        not isinstance(cache_entry, CacheEntry)
+        or cache_entry.fingerprint != fingerprint
+    ):
+        log.warning(message="Parse cache entry does not match", cache_path=cache_path)
+        return None
+
+    os.utime(cache_path)
+    log.info(message="Parse cache hit", cache_path=cache_path)
+    return cache_entry.parser_output
+
+
+def save_cached_output(cache_path: str, cache_entry: CacheEntry) -> None:
+    log = structlog.get_logger()
+
+    log.info(message="Saving parse cache entry", cache_path=cache_path)
+
+    temp_path = f"{cache_path}.tmp"
+
+    with open(temp_path, mode="wb") as cache_file:
+        pickle.dump(cache_entry, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.replace(temp_path, cache_path)
+
+
+def evict_parse_cache(cache_dir: str, max_age: float, max_size: int) -> List[str]:
+    log = structlog.get_logger()
+
+    cache_files = []
+
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and entry.name.endswith(".cache"):
+            entry_stat = entry.stat()
+            cache_files.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+
+    cache_files.sort(reverse=True)
+
+    now = time.time()
+    cache_size = 0
+    evicted = []
+
+    for mtime, size, path in cache_files:
+        if now - mtime > max_age or cache_size + size > max_size:
+            os.remove(path)
+            evicted.append(path)
+            continue
+
+        cache_size += size
+
+    log.info(
+        message="Parse cache evicted",
+        cache_dir=cache_dir,
+        evicted=len(evicted),
+        kept=len(cache_files) - len(evicted),
+    )
+    return evicted
+
+
+def parse_log_cached(
+    log_path: str,
+    extention: str,
+    options: ParseOptions = ParseOptions(),
+    cache_options: CacheOptions = CacheOptions(),
+) -> ParserOutput:
+    if not cache_options.cache_dir:
+        return parse_log(log_path, extention, options)
+
+    fingerprint = get_log_fingerprint(log_path, options)
+    cache_path = get_cache_path(cache_options.cache_dir, fingerprint)
+    parser_output = load_cached_output(cache_path, fingerprint)
+
+    # the error counts are kept with the cached output, so a cache hit is
+    # still held to the current MAX_ERROR_RATIO
+    if parser_output is not None and parser_output.errors is not None:
+        report_parse_errors(
+            parser_output.errors,
+            log_path,
+            options.error_samples,
+            options.max_error_ratio,
+        )
+        return parser_output
+
+    parser_output = parse_log(log_path, extention, options)
+    save_cached_output(cache_path, CacheEntry(fingerprint, parser_output))
+    evict_parse_cache(
+        cache_options.cache_dir, cache_options.max_age, cache_options.max_size
+    )
+
+    return parser_output
+
+
+AGGREGATE_STORE_VERSION = 2
+AGGREGATE_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS totals (
+    date TEXT PRIMARY KEY,
+    quantile_backend TEXT NOT NULL,
+    entries INTEGER NOT NULL,
+    request_time REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS aggregates (
+    date TEXT NOT NULL,
+    url TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    time_sum REAL NOT NULL,
+    time_max REAL NOT NULL,
+    error REAL NOT NULL,
+    quantiles TEXT NOT NULL,
+    PRIMARY KEY (date, url)
+) WITHOUT ROWID;
+"""
+
+# the collapsed tail row never takes one of the top slots, it is always loaded
+AGGREGATE_STORE_TOP_QUERY = """
+WITH top AS (
+    SELECT url FROM aggregates
+    WHERE date BETWEEN ? AND ? AND url != ?
+    GROUP BY url
+    ORDER BY SUM(time_sum + error) DESC
+    LIMIT ?
+)
+SELECT date, url, count, time_sum, time_max, error, quantiles
+FROM aggregates
+WHERE date BETWEEN ? AND ? AND (url IN (SELECT url FROM top) OR url = ?)
+"""
+
+
+def connect_aggregate_store(store_path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(store_path, timeout=60)
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+
+    if version != AGGREGATE_STORE_VERSION:
+        tables = connection.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'"
+        ).fetchone()[0]
+
+        if tables:
+            connection.close()
+            raise sqlite3.DatabaseError(
+                f"aggregate store version {version} is not supported, "
+                f"expected {AGGREGATE_STORE_VERSION}"
+            )
+
+        connection.execute(f"PRAGMA user_version = {AGGREGATE_STORE_VERSION}")
+
+    connection.executescript(AGGREGATE_STORE_SCHEMA)
+    return connection
+
+
+def get_sketch_backend(quantile_backend: str) -> str:
+    return "tdigest" if quantile_backend == "tdigest" else "histogram"
+
+
+def dump_quantile_sketch(quantiles) -> str:
+    # Stored days keep a bounded sketch as plain json: exact samples are
+    # folded into histogram buckets, t-digests keep their centroids.
+    if isinstance(quantiles, TDigestQuantiles):
+        if quantiles.buffer:
+            quantiles._compress()
+
+        sketch: Dict = {
+            "means": list(quantiles.means),
+            "weights": list(quantiles.weights),
+            "count": quantiles.count,
+            "min": quantiles.min,
+            "max": quantiles.max,
+        }
+    else:
+        if isinstance(quantiles, ExactQuantiles):
+            histogram = HistogramQuantiles()
+
+            for value in quantiles.samples:
+                histogram.add(value)
+
+            quantiles = histogram
+
+        sketch = {
+            "buckets": sorted(quantiles.buckets.items()),
+            "zero_count": quantiles.zero_count,
+            "count": quantiles.count,
+        }
+
+    return json.dumps(sketch, separators=(",", ":"))
+
+
+def load_quantile_sketch(data: str):
+    sketch = json.loads(data)
+
+    if "means" in sketch:
+        tdigest = TDigestQuantiles()
+        tdigest.means = array("d", sketch["means"])
+        tdigest.weights = array("d", sketch["weights"])
+        tdigest.count = sketch["count"]
+        tdigest.min = sketch["min"]
+        tdigest.max = sketch["max"]
+        return tdigest
+
+    histogram = HistogramQuantiles()
+    histogram.buckets = {idx: bucket_count for idx, bucket_count in sketch["buckets"]}
+    histogram.zero_count = sketch["zero_count"]
+    histogram.count = sketch["count"]
+    return histogram
+
+
+def save_aggregates(
+    store_path: str,
+    log_date: str,
+    parser_output: ParserOutput,
+    quantile_backend: str = "exact",
+) -> bool:
+    log = structlog.get_logger()
+
+    log.info(
+        message="Saving aggregates",
+        store_path=store_path,
+        log_date=log_date,
+        urls=len(parser_output.entries),
+    )
+
+    rows = (
+        (
+            log_date,
+            url,
+            aggregate.count,
+            aggregate.time_sum,
+            aggregate.time_max,
+            aggregate.error,
+            dump_quantile_sketch(aggregate.quantiles),
+        )
+        for url, aggregate in parser_output.entries.items()
+    )
+
+    try:
+        connection = connect_aggregate_store(store_path)
+    except sqlite3.Error as ex:
+        log.error(message="Can not open aggregate store", error=str(ex))
+        return False
+
+    try:
+        with connection:
+            connection.execute("DELETE FROM aggregates WHERE date = ?", (log_date,))
+            connection.execute(
+                "INSERT OR REPLACE INTO totals VALUES (?, ?, ?, ?)",
+                (
+                    log_date,
+                    get_sketch_backend(quantile_backend),
+                    parser_output.total["entries"],
+                    parser_output.total["request_time"],
+                ),
+            )
+            connection.executemany(
+                "INSERT INTO aggregates VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+    except sqlite3.Error as ex:
+        log.error(message="Failed to save aggregates", error=str(ex))
+        return False
+    finally:
+        connection.close()
+
+    return True
+
+
+def load_aggregates(
+    store_path: str, date_from: str, date_to: str, size: int = -1
+) -> Optional[ParserOutput]:
+    log = structlog.get_logger()
+
+    log.info(
+        message="Loading aggregates",
+        store_path=store_path,
+        date_from=date_from,
+        date_to=date_to,
+        size=size,
+    )
+
+    try:
+        connection = connect_aggregate_store(store_path)
+    except sqlite3.Error as ex:
+        log.error(message="Can not open aggregate store", error=str(ex))
+        return None
+
+    try:
+        totals = connection.execute(
+            "SELECT date, quantile_backend, entries, request_time "
+            "FROM totals WHERE date BETWEEN ? AND ? ORDER BY date",
+            (date_from, date_to),
+        ).fetchall()
+
+        if not totals:
+            log.error(message="No aggregates stored for date range")
+            return None
+
+        quantile_backends = sorted({row[1] for row in totals})
+
+        if len(quantile_backends) > 1:
+            log.error(
+                message="Aggregates in date range use different quantile backends",
+                quantile_backends=quantile_backends,
+            )
+            return None
+
+        log.info(message="Stored days found", days=len(totals))
+
+        days: Dict = {log_date: {} for log_date, *_ in totals}
+        rows = connection.execute(
+            AGGREGATE_STORE_TOP_QUERY,
+            (date_from, date_to, OTHER_URL, size, date_from, date_to, OTHER_URL),
+        )
+
+        for log_date, url, count, time_sum, time_max, error, quantiles in rows:
+            quantile_sketch = load_quantile_sketch(quantiles)
+            aggregate = (
+                HeavyHitterAggregate(quantile_sketch, error)
+                if error
+                else UrlAggregate(quantile_sketch)
+            )
+            aggregate.count = count
+            aggregate.time_sum = time_sum
+            aggregate.time_max = time_max
+            days[log_date][url] = aggregate
+    except (sqlite3.Error, ValueError, KeyError, TypeError) as ex:
+        log.error(message="Failed to load aggregates", error=str(ex))
+        return None
+    finally:
+        connection.close()
+
+    # merging day by day widens the error of urls missing from a day by the
+    # threshold that day's tail was collapsed with
+    parser_output = merge_parser_outputs(
+        ParserOutput(days[log_date], {"entries": entries, "request_time": request_time})
+        for log_date, _, entries, request_time in totals
+    )
+
+    log.info(
+        message="Aggregates loaded",
+        urls=len(parser_output.entries),
+        total=parser_output.total,
+    )
+    return parser_output
+
+
+def get_report_range(report_range) -> Optional[Tuple[str, str]]:
+    if not isinstance(report_range, (list, tuple)) or len(report_range) != 2:
+        return None
+
+    date_from, date_to = (str(date) for date in report_range)
+
+    if not all(re.fullmatch(r"\d{8}", date) for date in (date_from, date_to)):
+        return None
+
+    if date_from > date_to:
+        return None
+
+    return date_from, date_to
+
+
+def select_top_entries(entries: Dict, size: int) -> Dict:
+    log = structlog.get_logger()
+
+    log.info(
+        message='Selecting top entries by "time_sum"',
+        current_size=len(entries),
+        select_size=size,
+    )
+
+    tail = entries.get(OTHER_URL)
+
+    if size < 0 or size >= len(entries) - (tail is not None):
+        return entries
+
+    # the collapsed tail is reported next to the top urls, not instead of one
+    top = heapq.nlargest(
+        size,
+        ((url, aggregate) for url, aggregate in entries.items() if url != OTHER_URL),
+        key=lambda item: item[1].time_sum + item[1].error,
+    )
+
+    if tail is not None:
+        top.append((OTHER_URL, tail))
+
+    return dict(top)
+
+
+def has_heavy_hitters(entries: Dict) -> bool:
+    # heavy-hitter counts are lower bounds, reports then show how far off the
+    # time_sum of each row may be
+    return any(isinstance(a, HeavyHitterAggregate) for a in entries.values())
+
+
+def calculate_metrics(etnries: Dict, total: Dict) -> List[Dict]:
+    log = structlog.get_logger()
+
+    log.info(message="Calculating metrics", total=total)
+
+    total_entries = total["entries"]
+    total_request_time = total["request_time"]
+    quantile_names = list(REPORT_QUANTILES)
+    quantile_values = list(REPORT_QUANTILES.values())
+    heavy_hitters = has_heavy_hitters(etnries)
+
+    metrics: List[Dict] = []
+
+    for url, aggregate in etnries.items():
+        count = aggregate.count
+        time_sum = aggregate.time_sum
+
+        entry_metrics: Dict = {
+            "url": url,
+            "count": count,
+            "count_perc": count / total_entries * 100,
+            "time_sum": time_sum,
+            "time_perc": time_sum / total_request_time * 100,
+            "time_avg": time_sum / count,
+            "time_max": aggregate.time_max,
+        }
+
+        if heavy_hitters:
+            entry_metrics["time_sum_error"] = aggregate.error
+
+        entry_quantiles = aggregate.quantiles.quantiles(quantile_values)
+        entry_metrics.update(zip(quantile_names, entry_quantiles))
+
+        metrics.append(entry_metrics)
+
+    return metrics
+
+
+def _exact_quantiles_numpy(aggregates: Iterable, counts) -> Dict:
+    if not len(counts):
+        return {name: [] for name in REPORT_QUANTILES}
+
+    samples = np.concatenate([np.frombuffer(a.quantiles.samples) for a in aggregates])
+    url_ids = np.repeat(np.arange(len(counts)), counts)
+    ordered = samples[np.lexsort((samples, url_ids))]
+    offsets = np.cumsum(counts) - counts
+
+    columns: Dict = {}
+
+    for name, q in REPORT_QUANTILES.items():
+        positions = q * (counts - 1)
+        lower = positions.astype(np.int64)
+        fraction = positions - lower
+        upper = np.minimum(lower + 1, counts - 1)
+
+        low_values = ordered[offsets + lower]
+        interpolated = low_values * (1 - fraction) + ordered[offsets + upper] * fraction
+        columns[name] = np.where(fraction > 0, interpolated, low_values).tolist()
+
+    return columns
+
+
+def calculate_metrics_numpy(etnries: Dict, total: Dict) -> List[Dict]:
+    log = structlog.get_logger()
+
+    log.info(message="Calculating metrics with numpy", total=total)
+
+    size = len(etnries)
+    aggregates = etnries.values()
+
+    counts = np.fromiter((a.count for a in aggregates), dtype=np.int64, count=size)
+    time_sums = np.fromiter((a.time_sum for a in aggregates), np.float64, size)
+    time_maxes = np.fromiter((a.time_max for a in aggregates), np.float64, size)
+
+    columns: Dict = {
+        "count": counts.tolist(),
+        "count_perc": (counts / total["entries"] * 100).tolist(),
+        "time_sum": time_sums.tolist(),
+        "time_perc": (time_sums / total["request_time"] * 100).tolist(),
+        "time_avg": (time_sums / counts).tolist(),
+        "time_max": time_maxes.tolist(),
+    }
+
+    if has_heavy_hitters(etnries):
+        columns["time_sum_error"] = [a.error for a in aggregates]
+
+    if all(isinstance(a.quantiles, ExactQuantiles) for a in aggregates):
+        columns.update(_exact_quantiles_numpy(aggregates, counts))
+    else:
+        quantile_values = list(REPORT_QUANTILES.values())
+        quantile_rows = [a.quantiles.quantiles(quantile_values) for a in aggregates]
+
+        for idx, name in enumerate(REPORT_QUANTILES):
+            columns[name] = [row[idx] for row in quantile_rows]
+
+    names = list(columns)
+    rows = zip(etnries, *columns.values())
+
+    return [dict(zip(["url", *names], row)) for row in rows]
+
+
+METRICS_ENGINES: Dict = {
+    "python": calculate_metrics,
+    "numpy": calculate_metrics_numpy,
+}
+
+
+def is_report_dir_exists(report_dir: Optional[str]):
+    log = structlog.get_logger()
+
+    log.info(message="Checking report dir exists", report_dir=report_dir)
+
+    if not report_dir:
+        log.debug(
+            message="Report dir path empty or None, returned False",
+            report_dir=report_dir,
+        )
+        return False
+
+    return os.path.exists(report_dir)
+
+
+def sort_metrics(metrics: List[Dict]) -> List[Dict]:
+    log = structlog.get_logger()
+
+    log.info(message='Sorting metrics by "time_sum"')
+
+    metrics.sort(reverse=True, key=lambda d: (d.get("time_sum", 0.0), 0))
+
+    log.info(message="Metrics sorted")
+
+    return metrics
+
+
+def truncate_metrics(metrics: List[Dict], size: int) -> List[Dict]:
+    log = structlog.get_logger()
+
+    log.info(
+        message="Truncating metrics", current_size=len(metrics), truncate_size=size
+    )
+
+    rows = [metric for metric in metrics if metric["url"] != OTHER_URL]
+    tail = [metric for metric in metrics if metric["url"] == OTHER_URL]
+
+    if not tail:
+        return metrics[0:size]
+
+    return rows[0:size] + tail
+
+
+def get_report_template(template_path: str) -> Optional[str]:
+    log = structlog.get_logger()
+
+    log.info(message="Getting report template content")
+
+    try:
+        return open(template_path, encoding="utf-8").read()
+    except FileNotFoundError:
+        log.error(
+            message="Report template file not found",
+            template_path=template_path,
+        )
         return None
     except UnicodeDecodeError:
         log.error(
@@ -334,15 +2493,206 @@ def get_report_template(template_path: str) -> Optional[str]:
         return None
 
 
-def insert_report_content(template: str, json_metrics: str) -> str:
+def split_report_template(template: str) -> List[str]:
+    return REPORT_PLACEHOLDER_PATTERN.split(template)
+
+
+def get_template_parts(template_path: str) -> Optional[List[str]]:
+    log = structlog.get_logger()
+
+    try:
+        mtime = os.stat(template_path).st_mtime_ns
+    except FileNotFoundError:
+        log.error(message="Report template file not found", template_path=template_path)
+        return None
+
+    cached = TEMPLATE_CACHE.get(template_path)
+
+    if cached and cached[0] == mtime:
+        log.debug(message="Using cached report template", template_path=template_path)
+        return cached[1]
+
+    template = get_report_template(template_path)
+
+    if not template:
+        return None
+
+    template_parts = split_report_template(template)
+    TEMPLATE_CACHE[template_path] = (mtime, template_parts)
+    return template_parts
+
+
+def get_report_context(
+    report_date: str, total: Dict, stats: Optional[PipelineStats] = None
+) -> Dict[str, str]:
+    stages = stats.stages if stats else {}
+
+    return {
+        "report_date": report_date,
+        "total_entries": json.dumps(total["entries"]),
+        "total_request_time": json.dumps(total["request_time"]),
+        "stage_timings": json.dumps(
+            {name: record["wall_time"] for name, record in stages.items()}
+        ),
+        "report_pages": "null",
+    }
+
+
+@contextlib.contextmanager
+def atomic_open(path: str, mode: str = "w", **kwargs) -> Generator:
+    temp_path = f"{path}.tmp"
+
+    try:
+        with open(temp_path, mode=mode, **kwargs) as file:
+            yield file
+
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def iter_json_metrics(metrics: List[Dict]) -> Generator[str, None, None]:
+    encode = json.JSONEncoder().encode
+
+    yield "["
+
+    for start in range(0, len(metrics), REPORT_WRITE_BATCH):
+        rows = ", ".join(
+            encode(row) for row in metrics[start : start + REPORT_WRITE_BATCH]
+        )
+        yield f", {rows}" if start else rows
+
+    yield "]"
+
+
+def stream_report(
+    report_path: str,
+    template_parts: List[str],
+    metrics: List[Dict],
+    context: Optional[Dict[str, str]] = None,
+) -> int:
+    log = structlog.get_logger()
+
+    log.info(message="Streaming report", report_path=report_path, rows=len(metrics))
+
+    context = context or {}
+
+    with atomic_open(
+        report_path, encoding="utf-8", buffering=READ_CHUNK_SIZE
+    ) as report_file:
+        report_file.write(template_parts[0])
+
+        for idx in range(1, len(template_parts), 2):
+            placeholder = template_parts[idx]
+
+            if placeholder == "table_json":
+                for chunk in iter_json_metrics(metrics):
+                    report_file.write(chunk)
+            else:
+                report_file.write(context.get(placeholder, f"${placeholder}"))
+
+            report_file.write(template_parts[idx + 1])
+
+    return os.path.getsize(report_path)
+
+
+def stream_jsonl_report(report_path: str, metrics: List[Dict]) -> int:
+    encode = json.JSONEncoder().encode
+
+    with atomic_open(
+        report_path, encoding="utf-8", buffering=READ_CHUNK_SIZE
+    ) as report_file:
+        for start in range(0, len(metrics), REPORT_WRITE_BATCH):
+            batch = metrics[start : start + REPORT_WRITE_BATCH]
+            report_file.write("".join(f"{encode(row)}\n" for row in batch))
+
+    return os.path.getsize(report_path)
+
+
+def stream_csv_report(report_path: str, metrics: List[Dict]) -> int:
+    with atomic_open(
+        report_path, encoding="utf-8", newline="", buffering=READ_CHUNK_SIZE
+    ) as report_file:
+        writer = csv.DictWriter(
+            report_file, fieldnames=REPORT_COLUMNS, extrasaction="ignore"
+        )
+        writer.writeheader()
+
+        for start in range(0, len(metrics), REPORT_WRITE_BATCH):
+            writer.writerows(metrics[start : start + REPORT_WRITE_BATCH])
+
+    return os.path.getsize(report_path)
+
+
+def write_parquet_report(report_path: str, metrics: List[Dict]) -> int:
+    schema = pyarrow.schema(
+        [
+            ("url", pyarrow.string()),
+            ("count", pyarrow.int64()),
+            *((name, pyarrow.float64()) for name in REPORT_COLUMNS[2:]),
+        ]
+    )
+
+    with atomic_open(report_path, mode="wb") as report_file:
+        with pyarrow.parquet.ParquetWriter(report_file, schema) as writer:
+            for start in range(0, len(metrics), REPORT_WRITE_BATCH):
+                batch = metrics[start : start + REPORT_WRITE_BATCH]
+                writer.write_batch(pyarrow.RecordBatch.from_pylist(batch, schema))
+
+    return os.path.getsize(report_path)
+
+
+def get_pages_path(report_path: str) -> str:
+    return f"{os.path.splitext(report_path)[0]}.pages"
+
+
+def write_report_pages(pages_path: str, metrics: List[Dict], page_size: int) -> int:
     log = structlog.get_logger()
 
-    log.info(message="Inserting metrics into template")
+    log.info(message="Writing report pages", pages_path=pages_path, rows=len(metrics))
+
+    temp_path = f"{pages_path}.tmp"
+
+    if os.path.exists(temp_path):
+        shutil.rmtree(temp_path)
 
-    return template.replace("$table_json", json_metrics)
+    os.mkdir(temp_path)
+    pages = -(-len(metrics) // page_size)
 
+    for page in range(1, pages):
+        start = page * page_size
+        page_path = f"{temp_path}/page-{page:05d}.js"
 
-def get_report_path(report_dir: Optional[str], report_date: str) -> Optional[str]:
+        with open(
+            page_path, mode="w", encoding="utf-8", buffering=READ_CHUNK_SIZE
+        ) as page_file:
+            page_file.write(f"reportPage({page}, ")
+
+            for chunk in iter_json_metrics(metrics[start : start + page_size]):
+                page_file.write(chunk)
+
+            page_file.write(");\n")
+
+    if os.path.exists(pages_path):
+        shutil.rmtree(pages_path)
+
+    os.replace(temp_path, pages_path)
+    return pages
+
+
+REPORT_WRITERS: Dict = {
+    "jsonl": stream_jsonl_report,
+    "csv": stream_csv_report,
+    "parquet": write_parquet_report,
+}
+REPORT_FORMATS = ("html", *REPORT_WRITERS)
+
+
+def get_report_path(
+    report_dir: Optional[str], report_date: str, report_format: str = "html"
+) -> Optional[str]:
     log = structlog.get_logger()
 
     log.info(
@@ -356,15 +2706,280 @@ def get_report_path(report_dir: Optional[str], report_date: str) -> Optional[str
         )
         return None
 
-    return f"{report_dir}/report-{report_date}.html"
+    return f"{report_dir}/report-{report_date}.{report_format}"
+
+
+def get_report_metrics(
+    parser_output: ParserOutput,
+    report_options: ReportOptions = ReportOptions(),
+    stats: Optional[PipelineStats] = None,
+) -> List[Dict]:
+    stats = stats or PipelineStats()
+    report_size = report_options.report_size
+
+    with stats.stage("select_top_entries") as record:
+        top_entries = select_top_entries(parser_output.entries, report_size)
+        record["lines"] = len(parser_output.entries)
+
+    with stats.stage("calculate_metrics") as record:
+        metrics = METRICS_ENGINES[report_options.metrics_engine](
+            top_entries, parser_output.total
+        )
+        record["lines"] = len(metrics)
+
+    with stats.stage("sort_metrics"):
+        metrics = sort_metrics(metrics)
+        return truncate_metrics(metrics, report_size)
+
+
+def write_report(
+    report_path: str,
+    metrics: List[Dict],
+    report_options: ReportOptions = ReportOptions(),
+    stats: Optional[PipelineStats] = None,
+    context: Optional[Dict[str, str]] = None,
+) -> bool:
+    log = structlog.get_logger()
+    stats = stats or PipelineStats()
+
+    if report_options.report_format in REPORT_WRITERS:
+        with stats.stage("stream_report") as record:
+            record["bytes"] = REPORT_WRITERS[report_options.report_format](
+                report_path, metrics
+            )
+            record["lines"] = len(metrics)
+
+        return True
+
+    with stats.stage("get_report_template"):
+        template_parts = get_template_parts(report_options.template_path)
+
+        if not template_parts:
+            log.error(message="Failed to get report template", report_path=report_path)
+            return False
+
+    page_size = report_options.page_size
+    pages_path = get_pages_path(report_path)
+
+    if page_size > 0 and len(metrics) > page_size:
+        with stats.stage("write_report_pages") as record:
+            pages = write_report_pages(pages_path, metrics, page_size)
+            record["lines"] = len(metrics)
+
+        context = {
+            **(context or {}),
+            "report_pages": json.dumps(
+                {
+                    "count": pages,
+                    "path": os.path.basename(pages_path),
+                    "size": page_size,
+                    "rows": len(metrics),
+                }
+            ),
+        }
+        metrics = metrics[:page_size]
+    elif os.path.exists(pages_path):
+        shutil.rmtree(pages_path)
+
+    with stats.stage("stream_report") as record:
+        record["bytes"] = stream_report(report_path, template_parts, metrics, context)
+        record["lines"] = len(metrics)
+
+    return True
+
+
+def get_stats_path(report_path: str) -> str:
+    return f"{os.path.splitext(report_path)[0]}.stats.json"
+
+
+def save_pipeline_stats(stats_path: str, stats: PipelineStats) -> None:
+    log = structlog.get_logger()
+
+    log.info(message="Saving pipeline stats", stats_path=stats_path)
+
+    temp_path = f"{stats_path}.tmp"
+
+    with open(temp_path, mode="w", encoding="utf-8") as stats_file:
+        json.dump(stats.as_dict(), stats_file)
+
+    os.replace(temp_path, stats_path)
+
+
+def report_pipeline_stats(
+    stats: PipelineStats,
+    report_path: str,
+    report_options: ReportOptions = ReportOptions(),
+) -> None:
+    log = structlog.get_logger()
+
+    log.info(message="Pipeline stats", report_path=report_path, **stats.as_dict())
+
+    if report_options.stats_file:
+        save_pipeline_stats(get_stats_path(report_path), stats)
+
+
+def build_report(
+    report_path: str,
+    report_date: str,
+    parser_output: ParserOutput,
+    report_options: ReportOptions = ReportOptions(),
+    stats: Optional[PipelineStats] = None,
+) -> bool:
+    stats = stats or PipelineStats()
+
+    metrics = get_report_metrics(parser_output, report_options, stats)
+    context = get_report_context(report_date, parser_output.total, stats)
+
+    if not write_report(report_path, metrics, report_options, stats, context):
+        return False
+
+    report_pipeline_stats(stats, report_path, report_options)
+    return True
+
+
+def process_log(
+    log_file: LogFile,
+    log_path: str,
+    report_path: str,
+    options: ParseOptions = ParseOptions(),
+    report_options: ReportOptions = ReportOptions(),
+    cache_options: CacheOptions = CacheOptions(),
+    checkpoint_path: Optional[str] = None,
+) -> Optional[float]:
+    log = structlog.get_logger()
+
+    started = time.perf_counter()
+    stats = PipelineStats()
+    log.info(message="Processing log file", log_path=log_path, report_path=report_path)
+
+    try:
+        with stats.stage("parse") as record:
+            if checkpoint_path:
+                parser_output = parse_log_incremental(
+                    log_path, checkpoint_path, options, record
+                )
+            else:
+                parser_output = parse_log_cached(
+                    log_path, log_file.extention, options, cache_options
+                )
+                record["lines"] = parser_output.total["entries"]
+                record["bytes"] = os.path.getsize(log_path)
+    except FileNotFoundError:
+        log.error(message="Log file could not be found", log_path=log_path)
+        return None
+    except CODEC_ERRORS as ex:
+        log.error(
+            message="Invalid compressed log file", log_path=log_path, error=str(ex)
+        )
+        return None
+    except ParseErrorLimitExceeded:
+        log.error(message="Too many unparseable lines", log_path=log_path)
+        return None
+
+    if report_options.aggregate_store:
+        with stats.stage("save_aggregates"):
+            save_aggregates(
+                report_options.aggregate_store,
+                log_file.date,
+                parser_output,
+                options.quantile_backend,
+            )
+
+    if not build_report(
+        report_path, log_file.date, parser_output, report_options, stats
+    ):
+        return None
+
+    return time.perf_counter() - started
+
+
+def get_unreported_logs(
+    log_files: List[LogFile],
+    log_dir: str,
+    report_dir: str,
+    overwrite: bool = False,
+    report_format: str = "html",
+) -> List[Tuple[LogFile, str, str]]:
+    log = structlog.get_logger()
+
+    tasks = []
+
+    for log_file in log_files:
+        report_path = str(get_report_path(report_dir, log_file.date, report_format))
+
+        if os.path.exists(report_path) and not overwrite:
+            log.debug(
+                message="Report already exists, skipped",
+                log_name=log_file.name,
+                report_path=report_path,
+            )
+            continue
+
+        tasks.append((log_file, str(get_log_path(log_file.name, log_dir)), report_path))
+
+    log.info(message="Unreported log files found", count=len(tasks))
+    return tasks
 
 
-def save_report(report_path: str, report: str) -> int:
+def backfill_reports(
+    tasks: List[Tuple[LogFile, str, str]],
+    workers: int,
+    options: ParseOptions = ParseOptions(),
+    report_options: ReportOptions = ReportOptions(),
+    cache_options: CacheOptions = CacheOptions(),
+) -> Dict[str, Optional[float]]:
     log = structlog.get_logger()
 
-    log.info(message="Saving file", report_path=report_path)
+    log.info(message="Starting backfill", tasks=len(tasks), workers=workers)
+
+    started = time.perf_counter()
+    timings: Dict[str, Optional[float]] = {}
+
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(
+                process_log, *task, options, report_options, cache_options
+            ): task
+            for task in tasks
+        }
+
+        for future in as_completed(futures):
+            log_file, log_path, report_path = futures[future]
+
+            try:
+                seconds = future.result()
+            except Exception as ex:
+                log.error(
+                    message="Unexpected error while processing log file",
+                    log_name=log_file.name,
+                    error=type(ex).__name__,
+                    details=str(ex),
+                )
+                seconds = None
+
+            timings[log_file.name] = seconds
+
+            if seconds is None:
+                log.error(
+                    message="Report generation failed",
+                    log_name=log_file.name,
+                    log_path=log_path,
+                )
+            else:
+                log.info(
+                    message="Report generated",
+                    log_name=log_file.name,
+                    report_path=report_path,
+                    seconds=round(seconds, 3),
+                )
 
-    return open(report_path, mode="w", encoding="utf-8").write(report)
+    log.info(
+        message="Backfill finished",
+        generated=sum(seconds is not None for seconds in timings.values()),
+        failed=sum(seconds is None for seconds in timings.values()),
+        seconds=round(time.perf_counter() - started, 3),
+    )
+    return timings
 
 
 def main(argv: List[str]) -> None:
@@ -391,15 +3006,242 @@ def main(argv: List[str]) -> None:
         if not app_config:
             sys.exit()
 
-    _configure_logger(app_config.get("LOG_FILE"))
+    log_level = str(app_config.get("LOG_LEVEL", "INFO")).upper()
+
+    if log_level not in LOG_LEVELS:
+        _configure_logger(app_config.get("LOG_FILE"))
+        structlog.get_logger().error(
+            message="Application exited: unknown log level", log_level=log_level
+        )
+        exit()
+
+    _configure_logger(app_config.get("LOG_FILE"), log_level)
 
     log = structlog.get_logger()
 
     log.info(message="Application started", app_config=app_config)
 
+    profile = app_config.get("PROFILE")
+
+    if not profile:
+        run_analyzer(app_config)
+        return
+
+    report_dir = app_config.get("REPORT_DIR")
+
+    if profile not in PROFILERS:
+        log.error(message="Application exited: unknown profiler", profile=profile)
+        exit()
+
+    if profile == "sampling" and not hasattr(signal, "setitimer"):
+        log.error(message="Application exited: sampling profiler is not supported")
+        exit()
+
+    if not is_report_dir_exists(report_dir):
+        log.error(message="Application exited: report dir does not exists")
+        exit()
+
+    run_profiled(
+        profile,
+        str(report_dir),
+        int(str(app_config.get("PROFILE_TOP", 30))),
+        run_analyzer,
+        app_config,
+    )
+
+
+def run_analyzer(app_config: Dict) -> None:
+    log = structlog.get_logger()
+
     log_dir = app_config.get("LOG_DIR")
     report_dir = app_config.get("REPORT_DIR")
     report_size = int(str(app_config.get("REPORT_SIZE")))
+    workers = int(str(app_config.get("WORKERS", 1)))
+    quantile_backend = str(app_config.get("QUANTILE_BACKEND", "exact"))
+    log_parser = str(app_config.get("LOG_PARSER", "regex"))
+    metrics_engine = str(app_config.get("METRICS_ENGINE", "python"))
+
+    if metrics_engine not in METRICS_ENGINES:
+        log.error(
+            message="Application exited: unknown metrics engine",
+            metrics_engine=metrics_engine,
+        )
+        exit()
+
+    if metrics_engine == "numpy" and np is None:
+        log.warning(
+            message="Numpy is not installed, falling back to python metrics engine"
+        )
+        metrics_engine = "python"
+
+    if log_parser not in LINE_PARSERS:
+        log.error(
+            message="Application exited: unknown log parser", log_parser=log_parser
+        )
+        exit()
+
+    if quantile_backend not in QUANTILE_BACKENDS:
+        log.error(
+            message="Application exited: unknown quantile backend",
+            quantile_backend=quantile_backend,
+        )
+        exit()
+
+    log_format = app_config.get("LOG_FORMAT")
+
+    if log_format and get_line_parser(log_parser, log_format) is None:
+        log.error(message="Application exited: invalid log format")
+        exit()
+
+    log_name_pattern = str(app_config.get("LOG_NAME_PATTERN"))
+
+    try:
+        if "date" not in re.compile(log_name_pattern).groupindex:
+            log.error(
+                message="Application exited: log name pattern has no date group",
+                log_name_pattern=log_name_pattern,
+            )
+            exit()
+    except re.error:
+        log.error(
+            message="Application exited: invalid log name pattern",
+            log_name_pattern=log_name_pattern,
+        )
+        exit()
+
+    url_query = str(app_config.get("URL_QUERY", "keep"))
+
+    if url_query not in URL_QUERY_MODES:
+        log.error(
+            message="Application exited: unknown url query mode", url_query=url_query
+        )
+        exit()
+
+    try:
+        url_rewrite_rules = tuple(
+            (str(pattern), str(replacement))
+            for pattern, replacement in app_config.get("URL_REWRITE_RULES") or []
+        )
+        get_url_normalizer(url_query, False, url_rewrite_rules)
+    except (TypeError, ValueError, re.error):
+        log.error(
+            message="Application exited: invalid url rewrite rules",
+            url_rewrite_rules=app_config.get("URL_REWRITE_RULES"),
+        )
+        exit()
+
+    heavy_hitters_capacity = None
+
+    if app_config.get("HEAVY_HITTERS"):
+        heavy_hitters_capacity = int(
+            str(app_config.get("HEAVY_HITTERS_CAPACITY") or 10 * report_size)
+        )
+
+        if heavy_hitters_capacity < max(report_size, 1):
+            log.error(
+                message="Application exited: heavy hitters capacity is less than "
+                "report size",
+                heavy_hitters_capacity=heavy_hitters_capacity,
+                report_size=report_size,
+            )
+            exit()
+
+    max_error_ratio = app_config.get("MAX_ERROR_RATIO")
+
+    if max_error_ratio is not None:
+        max_error_ratio = float(max_error_ratio)
+
+    options = ParseOptions(
+        log_parser,
+        quantile_backend,
+        log_format,
+        workers,
+        bool(app_config.get("DECOMPRESS_THREAD", True)),
+        app_config.get("GZIP_COMMAND"),
+        int(str(app_config.get("PARSE_ERROR_SAMPLES", 10))),
+        max_error_ratio,
+        url_query,
+        bool(app_config.get("URL_COLLAPSE_IDS", False)),
+        url_rewrite_rules,
+        heavy_hitters_capacity,
+    )
+    report_format = str(app_config.get("REPORT_FORMAT", "html"))
+
+    if report_format not in REPORT_FORMATS:
+        log.error(
+            message="Application exited: unknown report format",
+            report_format=report_format,
+        )
+        exit()
+
+    if report_format == "parquet" and pyarrow is None:
+        log.error(message="Application exited: pyarrow package is not installed")
+        exit()
+
+    aggregate_store = app_config.get("AGGREGATE_STORE")
+    report_options = ReportOptions(
+        report_size,
+        metrics_engine,
+        aggregate_store,
+        bool(app_config.get("STATS_FILE", False)),
+        str(app_config.get("REPORT_TEMPLATE", REPORT_TEMPLATE_PATH)),
+        report_format,
+        int(str(app_config.get("REPORT_PAGE_SIZE", 0))),
+    )
+    incremental = bool(app_config.get("INCREMENTAL", False))
+    overwrite = bool(app_config.get("OVERWRITE_REPORT", False))
+    cache_options = CacheOptions(
+        app_config.get("PARSE_CACHE_DIR"),
+        float(str(app_config.get("PARSE_CACHE_MAX_AGE", 604800))),
+        int(str(app_config.get("PARSE_CACHE_MAX_SIZE", 1 << 30))),
+    )
+
+    if cache_options.cache_dir and not os.path.isdir(cache_options.cache_dir):
+        log.error(
+            message="Application exited: parse cache dir does not exists",
+            cache_dir=cache_options.cache_dir,
+        )
+        exit()
+
+    if app_config.get("REPORT_RANGE"):
+        report_range = get_report_range(app_config.get("REPORT_RANGE"))
+
+        if not report_range:
+            log.error(
+                message="Application exited: invalid report range",
+                report_range=app_config.get("REPORT_RANGE"),
+            )
+            exit()
+
+        if not aggregate_store or not os.path.exists(aggregate_store):
+            log.error(
+                message="Application exited: aggregate store does not exists",
+                aggregate_store=aggregate_store,
+            )
+            exit()
+
+        stats = PipelineStats()
+
+        with stats.stage("load_aggregates"):
+            parser_output = load_aggregates(aggregate_store, *report_range, report_size)
+
+        if not parser_output:
+            log.error(message="Application exited: failed to load aggregates")
+            exit()
+
+        report_path = get_report_path(report_dir, "-".join(report_range), report_format)
+
+        if not report_path or not is_report_dir_exists(report_dir):
+            log.error(message="Application exited: report dir does not exists")
+            exit()
+
+        if not build_report(
+            report_path, "-".join(report_range), parser_output, report_options, stats
+        ):
+            log.error(message="Application exited: failed to get report template")
+            exit()
+
+        return
 
     if not is_log_dir_exists(log_dir):
         log.error(message="Application exited: log dir does not exists")
@@ -411,19 +3253,40 @@ def main(argv: List[str]) -> None:
         log.error(message="Application exited: log dir is empty")
         exit()
 
-    latest_log = search_latest(log_files)
+    if app_config.get("BACKFILL"):
+        if not is_report_dir_exists(report_dir):
+            log.error(message="Application exited: report dir does not exists")
+            exit()
+
+        tasks = get_unreported_logs(
+            search_logs(log_files, log_name_pattern),
+            str(log_dir),
+            str(report_dir),
+            overwrite,
+            report_format,
+        )
+        backfill_reports(
+            tasks,
+            int(str(app_config.get("BACKFILL_WORKERS", 1))),
+            options,
+            report_options,
+            cache_options,
+        )
+        return
+
+    latest_log = search_latest(log_files, log_name_pattern)
 
     if not latest_log or not latest_log.name:
         log.error(message="Application exited: lates log could not be found")
         exit()
 
-    report_path = get_report_path(report_dir, latest_log.date)
+    report_path = get_report_path(report_dir, latest_log.date, report_format)
 
     if not report_path:
         log.error(message="Application exited: failed to get report path")
         exit()
 
-    if os.path.exists(report_path):
+    if os.path.exists(report_path) and not (incremental or overwrite):
         log.info(
             message="Application exited: report for latest log already exists",
             latest_log=latest_log.name,
@@ -437,44 +3300,45 @@ def main(argv: List[str]) -> None:
         log.error(message="Application exited: failed to get log path")
         exit()
 
-    try:
-        log_file: IO[str] = (
-            gzip.open(str(log_path), mode="rt", encoding="utf-8")
-            if latest_log.extention == ".gz"
-            else open(str(log_path), encoding="utf-8")
-        )
-    except FileNotFoundError:
-        log.error(
-            message="Application exited: latest log file could not be found",
-            log_path=log_path,
-            log_extention=latest_log.extention,
-        )
-        exit()
-    except gzip.BadGzipFile:
+    if latest_log.extention == ".zst" and zstandard is None:
         log.error(
-            message="Application exited: invalid gzip file",
+            message="Application exited: zstandard package is not installed",
             log_path=log_path,
-            log_extention=latest_log.extention,
         )
         exit()
 
-    parser = entries_parser(log_file)
-    parser_output = parse_entries(parser)
+    checkpoint_path = None
 
-    metrics = calculate_metrics(parser_output.entries, parser_output.total)
-    metrics = sort_metrics(metrics)
-    metrics = truncate_metrics(metrics, report_size)
-    metrics_json = get_json_metrics(metrics)
+    if incremental and latest_log.extention not in CODECS:
+        checkpoint_dir = app_config.get("CHECKPOINT_DIR")
+        checkpoint_path = get_checkpoint_path(checkpoint_dir, latest_log.name)
+
+        if not checkpoint_path or not os.path.isdir(str(checkpoint_dir)):
+            log.error(message="Application exited: checkpoint dir does not exists")
+            exit()
+    elif incremental:
+        log.warning(
+            message="Incremental mode is not supported for compressed logs",
+            log_path=log_path,
+        )
 
     if not is_report_dir_exists(report_dir):
         log.error(message="Application exited: report dir does not exists")
         exit()
 
-    report_template = get_report_template("report.html")
+    seconds = process_log(
+        latest_log,
+        log_path,
+        report_path,
+        options,
+        report_options,
+        cache_options,
+        checkpoint_path,
+    )
 
-    if not report_template:
-        log.error(message="Application exited: failed to get report template")
+    if seconds is None:
+        log.error(
+            message="Application exited: failed to process latest log",
+            log_path=log_path,
+        )
         exit()
-
-    report = insert_report_content(str(report_template), metrics_json)
-    save_report(report_path, report)
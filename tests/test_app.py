@@ -1,7 +1,17 @@
+import bz2
+import csv
+import gzip
 import json
+import lzma
+import math
 import os
+import pickle
+import random
+import shutil
+import sqlite3
+from collections import namedtuple
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 
 import pytest
 
@@ -10,10 +20,65 @@ import src.app.module as app
 app._configure_logger(None)
 
 
+def make_entries(samples: Dict[str, List[float]], backend: str = "exact") -> Dict:
+    entries: Dict = {}
+
+    for url, request_times in samples.items():
+        entries[url] = app.UrlAggregate(app.QUANTILE_BACKENDS[backend]())
+
+        for request_time in request_times:
+            entries[url].add(request_time)
+
+    return entries
+
+
+def run_main(
+    tmp_path: Path,
+    config: Optional[Dict] = None,
+    logs: Optional[Dict[str, bytes]] = None,
+) -> Path:
+    log_dir = tmp_path / "log"
+    log_dir.mkdir(exist_ok=True)
+
+    report_dir = tmp_path / "reports"
+    report_dir.mkdir(exist_ok=True)
+
+    if logs is not None:
+        for path in log_dir.iterdir():
+            path.unlink()
+
+        for log_name, log_content in logs.items():
+            (log_dir / log_name).write_bytes(log_content)
+
+    config_file = tmp_path / "config.json"
+    config_file.write_text(
+        json.dumps(
+            {"REPORT_DIR": str(report_dir), "LOG_DIR": str(log_dir), **(config or {})}
+        )
+    )
+    app.main(["--config", str(config_file)])
+
+    return report_dir
+
+
+def summarize_entries(entries: Dict) -> Dict:
+    return {
+        url: (
+            aggregate.count,
+            pytest.approx(aggregate.time_sum),
+            aggregate.time_max,
+            list(aggregate.quantiles.samples),
+        )
+        for url, aggregate in entries.items()
+    }
+
+
 @pytest.fixture
 def sample_parser_output() -> app.ParserOutput:
     return app.ParserOutput(
-        {"/index.html": [0.1, 0.2, 0.3], "/api/data": [0.4, 0.5], "/about": [0.6]},
+        make_entries(
+            {"/index.html": [0.1, 0.2, 0.3], "/api/data": [0.4, 0.5], "/about": [0.6]}
+        ),
         {"entries": 6, "request_time": 2.1},
     )
 
@@ -171,8 +236,14 @@ def test_search_latest():
     result = app.search_latest(log_files)
 
     assert result.date == "20230605"
-    assert result.name == "nginx-access-ui.log-20230605.gz"
-    assert result.extention == ".gz"
+    assert result.name == "nginx-access-ui.log-20230605.bz2"
+    assert result.extention == ".bz2"
+
+    for extention in [".gz", ".xz", ".zst"]:
+        result_with_codec = app.search_latest(
+            [f"nginx-access-ui.log-20230607{extention}"]
+        )
+        assert result_with_codec.extention == extention
 
     log_files.append("nginx-access-ui.log-20230606")
 
@@ -201,6 +272,22 @@ def test_search_latest():
     assert no_match_result == app.LogFile("", "00000000", ".log")
 
 
+def test_search_latest_custom_pattern():
+    log_files = [
+        "billing.access.log-2023-06-01",
+        "billing.access.log-2023-06-03.gz",
+        "nginx-access-ui.log-20230605",
+    ]
+
+    result = app.search_latest(
+        log_files, r"^billing\.access\.log-(?P<date>\d{4}-\d{2}-\d{2})(?:\.gz)?$"
+    )
+
+    assert result == app.LogFile(
+        "billing.access.log-2023-06-03.gz", "2023-06-03", ".gz"
+    )
+
+
 @pytest.mark.parametrize(
     "log_name, log_dir, expected",
     [
@@ -216,7 +303,124 @@ def test_get_log_path(log_name: str, log_dir: Optional[str], expected: str):
     assert result == expected
 
 
-def test_entries_parser(tmp_path: Path):
+def test_split_lines(tmp_path: Path):
+    log_file = tmp_path / "test_log.txt"
+    log_file.write_bytes(b"first line\nsecond\xff line\n\nlast line")
+
+    with open(log_file, mode="rb") as file:
+        assert list(app.split_lines(app.read_chunks(file, chunk_size=4))) == [
+            b"first line",
+            b"second\xff line",
+            b"",
+            b"last line",
+        ]
+
+    with open(log_file, mode="rb") as file:
+        assert list(app.split_lines(app.read_chunks(file, limit=11, chunk_size=3))) == [
+            b"first line"
+        ]
+
+    with open(log_file, mode="rb") as file:
+        assert list(app.split_lines(app.read_chunks(file, limit=0))) == []
+
+
+def test_map_lines(tmp_path: Path):
+    log_file = tmp_path / "test_log.txt"
+    log_file.write_bytes(b"first line\nsecond line\n\nlast line")
+
+    assert list(app.map_lines(str(log_file))) == [
+        b"first line",
+        b"second line",
+        b"",
+        b"last line",
+    ]
+    assert list(app.map_lines(str(log_file), 11, 24)) == [b"second line", b""]
+    assert list(app.map_lines(str(log_file), 24, 1000)) == [b"last line"]
+
+    empty_file = tmp_path / "empty_log.txt"
+    empty_file.touch()
+    assert list(app.map_lines(str(empty_file))) == []
+
+
+def test_threaded_chunks():
+    chunks = [b"first", b"second", b"third"] * 20
+    assert list(app.threaded_chunks(iter(chunks), queue_size=2)) == chunks
+
+    def failing_chunks():
+        yield b"first"
+        raise EOFError("truncated")
+
+    threaded = app.threaded_chunks(failing_chunks())
+    assert next(threaded) == b"first"
+    with pytest.raises(EOFError):
+        next(threaded)
+
+    endless = app.threaded_chunks(iter(lambda: b"chunk", None), queue_size=1)
+    assert next(endless) == b"chunk"
+    endless.close()
+
+
+def compress_log(content: bytes, extention: str) -> bytes:
+    if extention == ".zst":
+        zstandard = pytest.importorskip("zstandard")
+        return zstandard.ZstdCompressor().compress(content)
+
+    compressors: Dict[str, Callable[[bytes], bytes]] = {
+        ".gz": gzip.compress,
+        ".bz2": bz2.compress,
+        ".xz": lzma.compress,
+    }
+    return compressors[extention](content)
+
+
+@pytest.mark.parametrize(
+    "extention, threaded, gzip_command",
+    [
+        (".gz", False, None),
+        (".gz", True, None),
+        (".gz", True, "gzip"),
+        (".bz2", True, None),
+        (".xz", True, None),
+        (".zst", True, None),
+    ],
+)
+def test_decompress_chunks(
+    tmp_path: Path, extention: str, threaded: bool, gzip_command: Optional[str]
+):
+    if gzip_command and not shutil.which(gzip_command):
+        pytest.skip(f"{gzip_command} is not installed")
+
+    content = b"".join(b"line %d\n" % idx for idx in range(100000))
+    log_file = tmp_path / f"test_log{extention}"
+    log_file.write_bytes(compress_log(content, extention))
+
+    chunks = app.decompress_chunks(str(log_file), extention, threaded, gzip_command)
+    assert b"".join(chunks) == content
+
+    broken_file = tmp_path / f"broken_log{extention}"
+    broken_file.write_bytes(b"not a compressed file")
+
+    with pytest.raises(app.CODEC_ERRORS):
+        b"".join(
+            app.decompress_chunks(str(broken_file), extention, threaded, gzip_command)
+        )
+
+
+@pytest.mark.parametrize("log_parser", ["regex", "ui_short"])
+def test_entries_parser_invalid_bytes(tmp_path: Path, log_parser: str):
+    log_file = tmp_path / "test_log.txt"
+    log_file.write_bytes(
+        b'192.168.1.1 - - [01/Jan/2023:00:00:01 +0000] "GET /caf\xc3\xa9 HTTP/1.1" 200 1234 "-" "Mozilla\xff\xfe" 0.123\n'
+        b'192.168.1.2 - - [01/Jan/2023:00:00:02 +0000] "GET /bad\xff HTTP/1.1" 200 1234 "-" "-" 0.456\n'
+    )
+
+    with open(log_file, mode="rb") as file:
+        parser = app.entries_parser(app.split_lines(app.read_chunks(file)), log_parser)
+        assert list(parser) == [("/caf\u00e9", 0.123), ("/bad\ufffd", 0.456)]
+
+
+@pytest.mark.parametrize("log_parser", ["regex", "ui_short"])
+def test_entries_parser(tmp_path: Path, log_parser: str):
     log_content = [
         '192.168.1.1 - - [01/Jan/2023:00:00:01 +0000] "GET /index.html HTTP/1.1" 200 1234 "-" "Mozilla/5.0" 0.123\n',
         '192.168.1.2 - - [01/Jan/2023:00:00:02 +0000] "POST /api/data HTTP/1.1" 201 567 "-" "PostmanRuntime/7.28.4" 0.456\n',
@@ -229,13 +433,114 @@ def test_entries_parser(tmp_path: Path):
     with open(log_file, mode="w", encoding="utf-8") as file:
         file.writelines(log_content)
 
-    with open(log_file, encoding="utf-8") as file:
-        parser = app.entries_parser(file)
-        assert next(parser, None) == {"url": "/index.html", "request_time": "0.123"}
-        assert next(parser, None) == {"url": "/api/data", "request_time": "0.456"}
-        assert next(parser, None) == {}
-        assert next(parser, None) == {"url": "/update", "request_time": "0.234"}
-        assert next(parser, None) is None
+    with open(log_file, mode="rb") as file:
+        parser = app.entries_parser(file, log_parser)
+        assert next(parser) == ("/index.html", 0.123)
+        assert next(parser) == ("/api/data", 0.456)
+        assert next(parser) is None
+        assert next(parser) == ("/update", 0.234)
+        assert next(parser, False) is False
+
+
+def test_entries_parser_error_ratio(monkeypatch: pytest.MonkeyPatch):
+    valid = b'1.1.1.1 - - [-] "GET /a HTTP/1.1" 200 1 "-" "-" 0.5'
+    lines = [valid, b"broken", valid, b"broken"]
+
+    errors = app.ParseErrors()
+    parser = app.entries_parser(
+        lines, error_samples=1, max_error_ratio=0.5, errors=errors
+    )
+    assert list(parser) == [("/a", 0.5), None, ("/a", 0.5), None]
+    assert (errors.lines, errors.failed) == (4, 2)
+    assert errors.samples == [{"offset": len(valid) + 1, "line": "broken"}]
+
+    app.report_parse_errors(errors, max_error_ratio=0.5)
+
+    with pytest.raises(app.ParseErrorLimitExceeded):
+        app.report_parse_errors(errors, max_error_ratio=0.25)
+
+    monkeypatch.setattr(app, "ERROR_RATIO_MIN_LINES", 10)
+    parser = app.entries_parser(iter([b"broken"] * 100), max_error_ratio=0.5)
+
+    with pytest.raises(app.ParseErrorLimitExceeded):
+        list(parser)
+
+    assert next(parser, None) is None
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        '1.1.1.1 - - [01/Jan/2023:00:00:01 +0000] "GET /a?b=c HTTP/1.1" 200 1 "-" "UA 1.0" "-" "1" "-" 0.390\n',
+        '1.1.1.1 - - [01/Jan/2023:00:00:01 +0000] "HEAD / HTTP/1.0" 200 1 "-" "-" 10.001',
+        '1.1.1.1 - - [01/Jan/2023:00:00:01 +0000] "0" 400 166 "-" "-" "-" "-" "-" 0.000\n',
+        '1.1.1.1 - - [01/Jan/2023:00:00:01 +0000] "GET /a HTTP/1.1" 200 1 "-" "-" -\n',
+        '1.1.1.1 - - [01/Jan/2023:00:00:01 +0000] "GET /a HTTP/1.1" 200 1 "-" "-"\n',
+        "no quotes at all 0.123\n",
+        "",
+        '1.1.1.1 - - [01/Jan/2023:00:00:01 +0000] "GET /a HTTP/1.1" 200 1 "-" "-" -0.5\n',
+        '1.1.1.1 - - [01/Jan/2023:00:00:01 +0000] "GET /a HTTP/1.1" 200 1 "-" "-" 1e3\n',
+        '1.1.1.1 - - [01/Jan/2023:00:00:01 +0000] "GET /a HTTP/1.1" 200 1 "-" "-" 1\n',
+        '1.1.1.1 - - [01/Jan/2023:00:00:01 +0000] "GET /a HTTP/1.1" 200 1 "-" "-" 0.5\r',
+        '1.1.1.1 - - [01/Jan/2023:00:00:01 +0000] "GET /a HTTP/1.1" 200 1 "-" "-" 0.5\r\n',
+        '1.1.1.1 - - [01/Jan/2023:00:00:01 +0000] "GET /a HTTP/1.1" 200 1 "-" "-" inf\n',
+        '1.1.1.1 - - [01/Jan/2023:00:00:01 +0000] "GET /a HTTP/1.1" 200 1 "-" "-" 0.\n',
+    ],
+)
+def test_line_parsers(line: str):
+    encoded_line = line.encode("utf-8")
+    assert app.parse_line_ui_short(encoded_line) == app.parse_line_regex(encoded_line)
+
+
+@pytest.mark.parametrize(
+    "parse_line",
+    [
+        app.parse_line_regex,
+        app.parse_line_ui_short,
+        app.get_line_parser(log_format='$remote_addr "$request" $request_time'),
+    ],
+)
+def test_line_parsers_share_urls(parse_line: Callable):
+    first = parse_line(b'1.1.1.1 "GET /shared/url HTTP/1.1" 0.100')
+    second = parse_line(b'2.2.2.2 "GET /shared/url HTTP/1.1" 0.200')
+
+    assert first[0] == "/shared/url"
+    assert first[0] is second[0]
+
+
+UI_SHORT_LOG_FORMAT = (
+    '$remote_addr  $remote_user $http_x_real_ip [$time_local] "$request" '
+    '$status $body_bytes_sent "$http_referer" '
+    '"$http_user_agent" "$http_x_forwarded_for" "$http_X_REQUEST_ID" "$http_X_RB_USER" '
+    "$request_time"
+)
+
+
+def test_compile_log_format():
+    parse_line = app.get_line_parser(log_format=UI_SHORT_LOG_FORMAT)
+
+    assert parse_line(
+        b'1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/v2/banner/25019354 HTTP/1.1" 200 927 "-" "Lynx/2.8.8dev.9 libwww-FM/2.14" "-" "1498697422-2190034393-4708-9752759" "dc7161be3" 0.390\n'
+    ) == ("/api/v2/banner/25019354", 0.39)
+    assert (
+        parse_line(
+            b'1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "0" 400 166 "-" "-" "-" "-" "-" 0.000\n'
+        )
+        is None
+    )
+    assert app.get_line_parser(log_format=UI_SHORT_LOG_FORMAT) is parse_line
+
+    custom_parser = app.get_line_parser(
+        log_format='$remote_addr [$time_local] "$request_uri" ${request_time}'
+    )
+    assert custom_parser(b'10.0.0.1 [01/Jan/2023:00:00:01 +0000] "/a?b=c" 1.5') == (
+        "/a?b=c",
+        1.5,
+    )
+    assert custom_parser(b"garbage") is None
+
+    assert app.compile_log_format("$remote_addr $status") is None
+    assert app.get_line_parser(log_format="$request") is None
 
 
 def test_parse_entries(tmp_path: Path):
@@ -251,20 +556,263 @@ def test_parse_entries(tmp_path: Path):
     with open(log_file, mode="w", encoding="utf-8") as file:
         file.writelines(log_content)
 
-    with open(log_file, encoding="utf-8") as file:
+    with open(log_file, mode="rb") as file:
         parser = app.entries_parser(file)
         result = app.parse_entries(parser)
 
+    with open(log_file, mode="rb") as file:
+        fast_result = app.parse_entries(app.entries_parser(file, "ui_short"))
+
+    assert summarize_entries(fast_result.entries) == summarize_entries(result.entries)
+    assert fast_result.total == result.total
+
     assert len(result.entries) == 3
 
-    assert result.entries["/index.html"] == [0.123]
-    assert result.entries["/api/data"] == [0.456]
-    assert result.entries["/update"] == [0.234]
+    assert list(result.entries["/index.html"].quantiles.samples) == [0.123]
+    assert list(result.entries["/api/data"].quantiles.samples) == [0.456]
+    assert list(result.entries["/update"].quantiles.samples) == [0.234]
+
+    assert result.entries["/index.html"].count == 1
+    assert result.entries["/index.html"].time_sum == 0.123
+    assert result.entries["/index.html"].time_max == 0.123
 
     assert result.total["entries"] == 3
     assert result.total["request_time"] == 0.813
 
 
+def test_url_aggregate():
+    aggregate = app.UrlAggregate(app.ExactQuantiles())
+
+    for request_time in [0.3, 0.1, 0.2]:
+        aggregate.add(request_time)
+
+    other = app.UrlAggregate(app.ExactQuantiles())
+    other.add(0.5)
+
+    aggregate.merge(other)
+
+    assert aggregate.count == 4
+    assert aggregate.time_sum == pytest.approx(1.1)
+    assert aggregate.time_max == 0.5
+    assert list(aggregate.quantiles.samples) == [0.3, 0.1, 0.2, 0.5]
+    assert aggregate.quantiles.median() == pytest.approx(0.25)
+
+
+def test_histogram_quantiles():
+    samples = [idx / 1000 for idx in range(1, 10001)]
+
+    histogram = app.HistogramQuantiles()
+    for sample in samples:
+        histogram.add(sample)
+
+    assert histogram.count == len(samples)
+    assert histogram.median() == pytest.approx(
+        samples[(len(samples) - 1) // 2], rel=app.HistogramQuantiles.RELATIVE_ACCURACY
+    )
+
+    left, right = app.HistogramQuantiles(), app.HistogramQuantiles()
+    for idx, sample in enumerate(samples):
+        (left if idx % 2 else right).add(sample)
+    left.merge(right)
+
+    assert left.buckets == histogram.buckets
+    assert left.median() == histogram.median()
+
+    zeros = app.HistogramQuantiles()
+    zeros.add(0.0)
+    assert zeros.median() == 0.0
+    assert app.HistogramQuantiles().median() == 0.0
+
+    accuracy = app.HistogramQuantiles.RELATIVE_ACCURACY
+
+    for values, q, expected in [
+        ([0.1, 0.3], 0.5, 0.2),
+        ([0.1, 0.2, 0.3, 1.0], 0.99, 0.979),
+    ]:
+        interpolated = app.HistogramQuantiles()
+        for value in values:
+            interpolated.add(value)
+
+        assert interpolated.quantiles([q])[0] == pytest.approx(expected, rel=accuracy)
+
+
+def test_exact_quantiles():
+    quantiles = app.ExactQuantiles()
+
+    assert quantiles.quantiles([0.5, 0.9]) == [0.0, 0.0]
+
+    for sample in [0.5, 0.1, 0.4, 0.2, 0.3]:
+        quantiles.add(sample)
+
+    assert quantiles.quantiles([0.0, 0.5, 1.0]) == [0.1, 0.3, 0.5]
+    assert quantiles.quantiles([0.9])[0] == pytest.approx(0.46)
+    assert quantiles.median() == 0.3
+
+
+@pytest.mark.parametrize("backend", ["histogram", "tdigest"])
+def test_approximate_quantiles(backend: str):
+    samples = [((idx * 7919) % 10000 + 1) / 1000 for idx in range(10000)]
+    qs = [0.5, 0.9, 0.95, 0.99]
+
+    exact = app.ExactQuantiles()
+    approximate = app.QUANTILE_BACKENDS[backend]()
+    left = app.QUANTILE_BACKENDS[backend]()
+    right = app.QUANTILE_BACKENDS[backend]()
+
+    for idx, sample in enumerate(samples):
+        exact.add(sample)
+        approximate.add(sample)
+        (left if idx % 2 else right).add(sample)
+
+    left.merge(right)
+
+    for expected, value, merged in zip(
+        exact.quantiles(qs), approximate.quantiles(qs), left.quantiles(qs)
+    ):
+        assert value == pytest.approx(expected, rel=0.01)
+        assert merged == pytest.approx(expected, rel=0.01)
+
+    assert app.QUANTILE_BACKENDS[backend]().quantiles(qs) == [0.0] * len(qs)
+
+
+def test_tdigest_quantiles_bounded():
+    digest = app.TDigestQuantiles()
+
+    for idx in range(100000):
+        digest.add(idx / 1000)
+
+    assert len(digest.means) <= app.TDigestQuantiles.COMPRESSION
+    assert len(digest.buffer) < app.TDigestQuantiles.BUFFER_SIZE
+    assert digest.count == 100000
+    assert digest.quantiles([0.0, 1.0]) == [0.0, 99.999]
+
+
+def test_get_shards(tmp_path: Path):
+    log_file = tmp_path / "test_log.txt"
+    log_file.write_bytes(b"".join(b"line %d\n" % idx for idx in range(100)))
+    log_size = log_file.stat().st_size
+
+    assert app.get_shards(str(log_file), 1) == [(0, log_size)]
+
+    shards = app.get_shards(str(log_file), 4)
+    assert len(shards) == 4
+    assert shards[0][0] == 0
+    assert shards[-1][1] == log_size
+
+    content = log_file.read_bytes()
+    for (_, end), (start, _) in zip(shards, shards[1:]):
+        assert end == start
+        assert content[start - 1 : start] == b"\n"
+
+    empty_file = tmp_path / "empty_log.txt"
+    empty_file.touch()
+    assert app.get_shards(str(empty_file), 4) == [(0, 0)]
+
+
+def test_parse_log_parallel(tmp_path: Path):
+    log_content = [
+        '192.168.1.1 - - [01/Jan/2023:00:00:01 +0000] "GET /index.html HTTP/1.1" 200 1234 "-" "Mozilla/5.0" 0.123\n',
+        '192.168.1.2 - - [01/Jan/2023:00:00:02 +0000] "POST /api/data HTTP/1.1" 201 567 "-" "PostmanRuntime/7.28.4" 0.456\n',
+        '192.168.1.3 - - [01/Jan/2023:00:00:03 +0000] "Invalid log entry" 400 100 "-" "-" 0.789\n',
+        '192.168.1.4 - - [01/Jan/2023:00:00:04 +0000] "PUT /update HTTP/1.1" 204 0 "-" "curl/7.68.0" 0.234\n',
+    ] * 25
+
+    log_file = tmp_path / "test_log.txt"
+
+    with open(log_file, mode="w", encoding="utf-8") as file:
+        file.writelines(log_content)
+
+    with open(log_file, mode="rb") as file:
+        serial = app.parse_entries(app.entries_parser(file))
+
+    parallel = app.parse_log_parallel(str(log_file), 3)
+    fast_parallel = app.parse_log_parallel(
+        str(log_file), 3, app.ParseOptions(log_parser="ui_short")
+    )
+
+    assert summarize_entries(fast_parallel.entries) == summarize_entries(
+        parallel.entries
+    )
+
+    assert summarize_entries(parallel.entries) == summarize_entries(serial.entries)
+    assert list(parallel.entries) == list(serial.entries)
+    assert parallel.total["entries"] == serial.total["entries"] == 75
+    assert parallel.total["request_time"] == pytest.approx(serial.total["request_time"])
+
+
+def test_parse_log_incremental(tmp_path: Path):
+    lines = [
+        b'192.168.1.1 - - [01/Jan/2023:00:00:01 +0000] "GET /index.html HTTP/1.1" 200 1234 "-" "Mozilla/5.0" 0.123\n',
+        b'192.168.1.2 - - [01/Jan/2023:00:00:02 +0000] "POST /api/data HTTP/1.1" 201 567 "-" "PostmanRuntime/7.28.4" 0.456\n',
+        b'192.168.1.4 - - [01/Jan/2023:00:00:04 +0000] "PUT /update HTTP/1.1" 204 0 "-" "curl/7.68.0" 0.234\n',
+    ]
+
+    log_file = tmp_path / "test_log.txt"
+    checkpoint_path = str(tmp_path / "test_log.txt.checkpoint")
+
+    log_file.write_bytes(lines[0] + lines[1][:40])
+    first = app.parse_log_incremental(str(log_file), checkpoint_path)
+
+    assert first.total["entries"] == 1
+
+    checkpoint = app.load_checkpoint(checkpoint_path)
+    assert checkpoint is not None
+    assert checkpoint.offset == len(lines[0])
+
+    with open(log_file, mode="ab") as file:
+        file.write(lines[1][40:] + lines[2] * 3)
+
+    record: Dict = {}
+    second = app.parse_log_incremental(
+        str(log_file), checkpoint_path, app.ParseOptions(), record
+    )
+    full = app.parse_log(str(log_file), ".log")
+
+    assert record == {
+        "lines": 4,
+        "bytes": log_file.stat().st_size - len(lines[0]),
+    }
+
+    assert summarize_entries(second.entries) == summarize_entries(full.entries)
+    assert second.total["entries"] == full.total["entries"] == 5
+
+    checkpoint = app.load_checkpoint(checkpoint_path)
+    assert checkpoint is not None
+    assert checkpoint.offset == log_file.stat().st_size
+
+    histogram = app.parse_log_incremental(
+        str(log_file), checkpoint_path, app.ParseOptions(quantile_backend="histogram")
+    )
+    assert histogram.total["entries"] == 5
+
+    collapsed = app.parse_log_incremental(
+        str(log_file),
+        checkpoint_path,
+        app.ParseOptions(quantile_backend="histogram", url_collapse_ids=True),
+    )
+    assert collapsed.total["entries"] == 5
+
+    checkpoint = app.load_checkpoint(checkpoint_path)
+    assert checkpoint is not None
+    assert checkpoint.parse_key == app.get_parse_key(
+        app.ParseOptions(quantile_backend="histogram", url_collapse_ids=True)
+    )
+
+    log_file.write_bytes(lines[2] * 6)
+    regrown = app.parse_log_incremental(
+        str(log_file),
+        checkpoint_path,
+        app.ParseOptions(quantile_backend="histogram", url_collapse_ids=True),
+    )
+    assert regrown.total["entries"] == 6
+    assert set(regrown.entries) == {"/update"}
+
+    broken_checkpoint = tmp_path / "broken.checkpoint"
+    broken_checkpoint.write_bytes(b"garbage")
+    assert app.load_checkpoint(str(broken_checkpoint)) is None
+    assert app.load_checkpoint(str(tmp_path / "missing.checkpoint")) is None
+
+
 def test_calculate_metrics(sample_parser_output: app.ParserOutput):
     entries = sample_parser_output.entries
     total = sample_parser_output.total
@@ -274,12 +822,14 @@ def test_calculate_metrics(sample_parser_output: app.ParserOutput):
     assert len(result) == 3
 
     for entry in result:
+        assert set(app.REPORT_QUANTILES) <= set(entry)
+
         if entry["url"] == "/index.html":
             assert entry["count"] == 3
             assert entry["count_perc"] == pytest.approx(50.0)
-            assert entry["time_sum"] == 0.6
+            assert entry["time_sum"] == pytest.approx(0.6)
             assert entry["time_perc"] == pytest.approx(28.57, rel=1e-2)
-            assert entry["time_avg"] == 0.2
+            assert entry["time_avg"] == pytest.approx(0.2)
             assert entry["time_max"] == 0.3
             assert entry["time_med"] == 0.2
         elif entry["url"] == "/api/data":
@@ -307,6 +857,60 @@ def test_calculate_metrics(sample_parser_output: app.ParserOutput):
     assert total_time_perc == pytest.approx(100.0)
 
 
+def test_select_top_entries():
+    entries = make_entries(
+        {
+            "/a": [1.0],
+            "/b": [3.0, 2.0],
+            "/c": [0.5],
+            "/d": [2.5, 2.5],
+            "/e": [4.0],
+        }
+    )
+
+    top = app.select_top_entries(entries, 3)
+    assert list(top) == ["/b", "/d", "/e"]
+    assert all(top[url] is entries[url] for url in top)
+
+    metrics = app.sort_metrics(
+        app.calculate_metrics(entries, {"entries": 7, "request_time": 15.5})
+    )
+    assert list(top) == [m["url"] for m in app.truncate_metrics(metrics, 3)]
+
+    assert app.select_top_entries(entries, 10) is entries
+    assert app.select_top_entries(entries, -1) is entries
+    assert app.select_top_entries(entries, 0) == {}
+    assert app.select_top_entries({}, 5) == {}
+
+
+def test_calculate_metrics_numpy(sample_parser_output: app.ParserOutput):
+    pytest.importorskip("numpy")
+
+    entries = sample_parser_output.entries
+    total = sample_parser_output.total
+
+    assert app.calculate_metrics_numpy(entries, total) == app.calculate_metrics(
+        entries, total
+    )
+    assert app.calculate_metrics_numpy({}, total) == []
+
+
+def test_exact_quantiles_selection(monkeypatch: pytest.MonkeyPatch):
+    pytest.importorskip("numpy")
+
+    samples = [((idx * 7919) % 1000) / 1000 for idx in range(1000)]
+    qs = list(app.REPORT_QUANTILES.values())
+
+    quantiles = app.ExactQuantiles()
+    for sample in samples:
+        quantiles.add(sample)
+
+    selected = quantiles.quantiles(qs)
+
+    monkeypatch.setattr(app, "np", None)
+    assert quantiles.quantiles(qs) == selected
+
+
 @pytest.mark.parametrize(
     "report_dir, expected_result",
     [
@@ -379,29 +983,6 @@ def test_truncate_metrics(sample_metrics: List[Dict]):
     assert all(isinstance(item, dict) for item in result)
 
 
-def test_get_json_metrics(sample_metrics: List[Dict]):
-    result = app.get_json_metrics(sample_metrics)
-
-    assert isinstance(result, str)
-
-    parsed_result = json.loads(result)
-    assert isinstance(parsed_result, list)
-    assert all(isinstance(item, dict) for item in parsed_result)
-
-    assert parsed_result == sample_metrics
-
-    empty_result = app.get_json_metrics([])
-    assert empty_result == "[]"
-
-    special_metrics = [{"url": "/page with spaces", "description": 'Test "quotes"'}]
-    special_result = app.get_json_metrics(special_metrics)
-    assert json.loads(special_result) == special_metrics
-
-    nested_metrics = [{"url": "/page1", "nested": {"key": "value"}}]
-    nested_result = app.get_json_metrics(nested_metrics)
-    assert json.loads(nested_result) == nested_metrics
-
-
 def test_get_report_template(tmp_path: Path):
     template_content = """
   <html>
@@ -422,27 +1003,11 @@ def test_get_report_template(tmp_path: Path):
     assert app.get_report_template(str(tmp_path / "non_existent_file.html")) is None
 
     non_utf8_file = tmp_path / "non_utf8.html"
-    non_utf8_file.write_bytes(b"\xFF\xFE" + "Non-UTF8 content".encode("utf-16-le"))
+    non_utf8_file.write_bytes(b"\xff\xfe" + "Non-UTF8 content".encode("utf-16-le"))
 
     assert app.get_report_template(str(non_utf8_file)) is None
 
 
-def test_insert_report_content():
-    template = "This is a template with $table_json placeholder."
-    json_metrics = '{"metric1": 10, "metric2": 20}'
-    expected_output = (
-        'This is a template with {"metric1": 10, "metric2": 20} placeholder.'
-    )
-
-    result = app.insert_report_content(template, json_metrics)
-
-    assert result == expected_output
-
-    assert app.insert_report_content("", "") == ""
-    assert app.insert_report_content("No placeholder", "{}") == "No placeholder"
-    assert app.insert_report_content("$table_json$table_json", "{}") == "{}{}"
-
-
 def test_get_report_path():
     report_dir = "reports"
     report_date = "20230425"
@@ -460,42 +1025,791 @@ def test_get_report_path():
     )
 
 
-def test_save_report(tmp_path: Path):
-    report_content = "This is a test report."
+@pytest.mark.parametrize("extention", ["", ".gz", ".bz2", ".xz", ".zst"])
+def test_main(tmp_path: Path, extention: str):
+    log_content = (
+        b'192.168.1.1 - - [01/Jan/2023:00:00:01 +0000] "GET /index.html HTTP/1.1" 200 1234 "-" "Mozilla/5.0" 0.123\n'
+        b'192.168.1.2 - - [01/Jan/2023:00:00:02 +0000] "POST /api/data HTTP/1.1" 201 567 "-" "PostmanRuntime/7.28.4" 0.456\n'
+        b'192.168.1.3 - - [01/Jan/2023:00:00:03 +0000] "Invalid log entry" 400 100 "-" "-" 0.789\n'
+        b'192.168.1.4 - - [01/Jan/2023:00:00:04 +0000] "PUT /update HTTP/1.1" 204 0 "-" "curl/7.68.0" 0.234\n'
+    )
+
+    report_dir = run_main(
+        tmp_path,
+        logs={
+            f"nginx-access-ui.log-20230605{extention}": (
+                compress_log(log_content, extention) if extention else log_content
+            )
+        },
+    )
+
+    expected_report_path = report_dir / "report-20230605.html"
+
+    assert expected_report_path.exists()
+    with open(expected_report_path, encoding="utf-8") as report_file:
+        report_content = report_file.read()
+    assert "$table_json" not in report_content
+    assert "/index.html" in report_content
+
+
+def test_search_logs():
+    log_files = [
+        "nginx-access-ui.log-20230603.gz",
+        "nginx-access-ui.log-20230601",
+        "nginx-access-ui.log-20230601.gz",
+        "nginx-access-ui.log-20230602.zip",
+        "some-other-file.log",
+    ]
+
+    assert app.search_logs(log_files) == [
+        app.LogFile("nginx-access-ui.log-20230601", "20230601", ".log"),
+        app.LogFile("nginx-access-ui.log-20230603.gz", "20230603", ".gz"),
+    ]
+    assert app.search_logs([]) == []
+
+
+def test_main_backfill(tmp_path: Path):
+    log_content = b'192.168.1.1 - - [01/Jan/2023:00:00:01 +0000] "GET /index.html HTTP/1.1" 200 1234 "-" "Mozilla/5.0" 0.123\n'
+
+    (tmp_path / "reports").mkdir()
+    (tmp_path / "reports" / "report-20230602.html").write_text("existing report")
+
+    report_dir = run_main(
+        tmp_path,
+        {"BACKFILL": True, "BACKFILL_WORKERS": 2},
+        {
+            "nginx-access-ui.log-20230601": log_content,
+            "nginx-access-ui.log-20230602.gz": gzip.compress(log_content),
+            "nginx-access-ui.log-20230603": log_content,
+            "nginx-access-ui.log-20230604.gz": b"broken",
+        },
+    )
+
+    assert sorted(path.name for path in report_dir.iterdir()) == [
+        "report-20230601.html",
+        "report-20230602.html",
+        "report-20230603.html",
+    ]
+    assert (report_dir / "report-20230602.html").read_text() == "existing report"
+    assert "/index.html" in (report_dir / "report-20230603.html").read_text()
+
+
+@pytest.mark.parametrize("backend", ["exact", "histogram"])
+def test_aggregate_store(tmp_path: Path, backend: str):
+    store_path = str(tmp_path / "aggregates.sqlite")
+
+    days = {
+        "20230601": {"/a": [0.1, 0.2], "/b": [1.0], "/c": [0.05]},
+        "20230602": {"/a": [0.3], "/b": [2.0, 0.5]},
+        "20230603": {"/a": [5.0]},
+    }
+
+    for log_date, samples in days.items():
+        entries = make_entries(samples, backend)
+        total = {
+            "entries": sum(len(times) for times in samples.values()),
+            "request_time": sum(sum(times) for times in samples.values()),
+        }
+        assert app.save_aggregates(
+            store_path, log_date, app.ParserOutput(entries, total), backend
+        )
+
+    parser_output = app.load_aggregates(store_path, "20230601", "20230602")
+
+    assert parser_output is not None
+    assert parser_output.total == {
+        "entries": 7,
+        "request_time": pytest.approx(4.15),
+    }
+    assert sorted(parser_output.entries) == ["/a", "/b", "/c"]
+    assert parser_output.entries["/b"].count == 3
+    assert parser_output.entries["/b"].time_sum == pytest.approx(3.5)
+    assert parser_output.entries["/b"].time_max == 2.0
+    assert parser_output.entries["/b"].quantiles.median() == pytest.approx(
+        1.0, rel=0.01
+    )
+
+    top = app.load_aggregates(store_path, "20230601", "20230603", 1)
+
+    assert top is not None
+    assert list(top.entries) == ["/a"]
+    assert top.entries["/a"].count == 4
+    assert top.total["entries"] == 8
+
+    assert app.load_aggregates(store_path, "20230701", "20230707") is None
+
+    with sqlite3.connect(store_path) as connection:
+        sketches = [
+            row[0] for row in connection.execute("SELECT quantiles FROM aggregates")
+        ]
+    assert all(isinstance(json.loads(sketch), dict) for sketch in sketches)
+
+
+def test_aggregate_store_sketch_size(tmp_path: Path):
+    store_path = str(tmp_path / "aggregates.sqlite")
+    rnd = random.Random(1)
+
+    sizes = []
+    for lines in (1000, 100_000):
+        entries = make_entries({"/a": [rnd.expovariate(5) for _ in range(lines)]})
+        total = {"entries": lines, "request_time": entries["/a"].time_sum}
+        assert app.save_aggregates(
+            store_path, "20230601", app.ParserOutput(entries, total)
+        )
+
+        with sqlite3.connect(store_path) as connection:
+            sizes.append(
+                connection.execute(
+                    "SELECT LENGTH(quantiles) FROM aggregates"
+                ).fetchone()[0]
+            )
+
+    assert sizes[1] < app.HistogramQuantiles.MAX_BUCKETS * 16
+
+    parser_output = app.load_aggregates(store_path, "20230601", "20230601")
+    assert parser_output is not None
+    assert parser_output.entries["/a"].quantiles.median() == pytest.approx(
+        math.log(2) / 5, rel=0.05
+    )
+
+
+def test_aggregate_store_heavy_hitters(tmp_path: Path):
+    store_path = str(tmp_path / "aggregates.sqlite")
+
+    for log_date in ("20230601", "20230602"):
+        parser_output = app.parse_entries(
+            [(f"/scan/{idx}", 0.5) for idx in range(40)]
+            + [(f"/hot/{idx}", 2.0 + idx) for idx in range(3) for _ in range(3)],
+            "exact",
+            heavy_hitters_capacity=4,
+        )
+        assert app.save_aggregates(store_path, log_date, parser_output)
+
+    threshold = parser_output.entries[app.OTHER_URL].error
+    loaded = app.load_aggregates(store_path, "20230601", "20230602", 2)
+
+    assert loaded is not None
+    assert sorted(loaded.entries) == ["/hot/1", "/hot/2", app.OTHER_URL]
+    assert loaded.entries[app.OTHER_URL].error == 2 * threshold
+    assert all(aggregate.error > 0 for aggregate in loaded.entries.values())
+
+    report = app.select_top_entries(loaded.entries, 1)
+    assert list(report) == ["/hot/2", app.OTHER_URL]
+
+    with sqlite3.connect(store_path) as connection:
+        connection.execute("PRAGMA user_version = 1")
+    assert app.load_aggregates(store_path, "20230601", "20230602") is None
+
+
+def test_get_report_range():
+    assert app.get_report_range(["20230601", "20230607"]) == ("20230601", "20230607")
+    assert app.get_report_range(["20230607", "20230601"]) is None
+    assert app.get_report_range(["2023-06-01", "20230607"]) is None
+    assert app.get_report_range("20230601") is None
+
+
+def test_main_report_range(tmp_path: Path):
+    config = {"AGGREGATE_STORE": str(tmp_path / "reports" / "aggregates.sqlite")}
+
+    for log_date, url in [("20230601", "/first"), ("20230602", "/second")]:
+        run_main(
+            tmp_path,
+            config,
+            {
+                f"nginx-access-ui.log-{log_date}": (
+                    f'1.1.1.1 - - [-] "GET {url} HTTP/1.1" 200 1 "-" "-" 0.5\n'.encode()
+                )
+            },
+        )
+
+    report_dir = run_main(
+        tmp_path, {**config, "REPORT_RANGE": ["20230601", "20230607"]}
+    )
+
+    report_content = (report_dir / "report-20230601-20230607.html").read_text()
+    assert "/first" in report_content
+    assert "/second" in report_content
+
+
+def test_parse_log_cached(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+
+    log_path = tmp_path / "nginx-access-ui.log-20230601"
+    log_path.write_bytes(
+        b'1.1.1.1 - - [-] "GET /a HTTP/1.1" 200 1 "-" "-" 0.5\n'
+        b'1.1.1.1 - - [-] "GET /b HTTP/1.1" 200 1 "-" "-" 0.25\n'
+    )
+
+    cache_options = app.CacheOptions(str(cache_dir))
+    parsed = app.parse_log_cached(str(log_path), "", cache_options=cache_options)
+
+    assert len(list(cache_dir.iterdir())) == 1
+
+    def fail_parse(*args, **kwargs):
+        raise AssertionError("cached log parsed again")
+
+    monkeypatch.setattr(app, "parse_log", fail_parse)
+    cached = app.parse_log_cached(str(log_path), "", cache_options=cache_options)
+
+    assert summarize_entries(cached.entries) == summarize_entries(parsed.entries)
+    assert cached.total == parsed.total
+
+    with pytest.raises(AssertionError):
+        app.parse_log_cached(
+            str(log_path),
+            "",
+            app.ParseOptions(quantile_backend="histogram"),
+            cache_options,
+        )
+
+    with open(log_path, mode="ab") as log_file:
+        log_file.write(b'1.1.1.1 - - [-] "GET /c HTTP/1.1" 200 1 "-" "-" 0.1\n')
+
+    with pytest.raises(AssertionError):
+        app.parse_log_cached(str(log_path), "", cache_options=cache_options)
+
+
+def test_parse_log_cached_error_ratio(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+
+    log_path = tmp_path / "nginx-access-ui.log-20230601"
+    log_path.write_bytes(
+        b'1.1.1.1 - - [-] "GET /a HTTP/1.1" 200 1 "-" "-" 0.5\nbroken\n'
+    )
+
+    cache_options = app.CacheOptions(str(cache_dir))
+    parsed = app.parse_log_cached(str(log_path), "", cache_options=cache_options)
+    assert parsed.errors.failed == 1
+
+    with pytest.raises(app.ParseErrorLimitExceeded):
+        app.parse_log_cached(
+            str(log_path), "", app.ParseOptions(max_error_ratio=0.1), cache_options
+        )
+
+    fingerprint = app.get_log_fingerprint(str(log_path))
+    cache_path = app.get_cache_path(str(cache_dir), fingerprint)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(
+            app,
+            "CacheEntry",
+            namedtuple(
+                "CacheEntry",
+                ["fingerprint", "parser_output", "extra"],
+                module=app.__name__,
+            ),
+        )
+        Path(cache_path).write_bytes(
+            pickle.dumps(app.CacheEntry(fingerprint, parsed, None))
+        )
+
+    assert app.load_cached_output(cache_path, fingerprint) is None
+
+
+def test_evict_parse_cache(tmp_path: Path):
+    now = os.path.getmtime(tmp_path)
+
+    for idx, (age, size) in enumerate([(0, 10), (10, 10), (20, 10), (1000, 1)]):
+        cache_path = tmp_path / f"{idx}.cache"
+        cache_path.write_bytes(b"x" * size)
+        os.utime(cache_path, (now - age, now - age))
+
+    (tmp_path / "other.txt").write_bytes(b"x" * 100)
+
+    evicted = app.evict_parse_cache(str(tmp_path), max_age=100, max_size=25)
+
+    assert sorted(Path(path).name for path in evicted) == ["2.cache", "3.cache"]
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "0.cache",
+        "1.cache",
+        "other.txt",
+    ]
+
+
+def test_pipeline_stats():
+    stats = app.PipelineStats()
+
+    with stats.stage("parse") as record:
+        record["lines"] = 100
+        record["bytes"] = 1000
+
+    with stats.stage("sort_metrics"):
+        pass
+
+    result = stats.as_dict()
+
+    assert list(result["stages"]) == ["parse", "sort_metrics"]
+    assert result["stages"]["parse"]["lines"] == 100
+    assert "bytes_per_sec" in result["stages"]["parse"]
+    assert "lines_per_sec" not in result["stages"]["sort_metrics"]
+    assert result["wall_time"] >= result["stages"]["parse"]["wall_time"]
+    assert result["peak_rss_mb"] >= 0
+
+
+@pytest.mark.skipif(
+    not app._reset_peak_rss(), reason="per-stage peak rss needs /proc/self/clear_refs"
+)
+def test_pipeline_stats_stage_peak_rss():
+    stats = app.PipelineStats()
+
+    with stats.stage("allocate"):
+        buffer = bytearray(128 << 20)
+        del buffer
+
+    with stats.stage("idle"):
+        pass
+
+    stages = stats.as_dict()["stages"]
+    assert stages["allocate"]["peak_rss_mb"] - stages["idle"]["peak_rss_mb"] > 64
+
+
+def test_main_stats_file(tmp_path: Path):
+    report_dir = run_main(
+        tmp_path,
+        {"STATS_FILE": True},
+        {
+            "nginx-access-ui.log-20230601": (
+                b'1.1.1.1 - - [-] "GET /a HTTP/1.1" 200 1 "-" "-" 0.5\n'
+            )
+        },
+    )
+
+    stats = json.loads((report_dir / "report-20230601.stats.json").read_text())
+
+    assert list(stats["stages"]) == [
+        "parse",
+        "select_top_entries",
+        "calculate_metrics",
+        "sort_metrics",
+        "get_report_template",
+        "stream_report",
+    ]
+    assert stats["stages"]["parse"]["lines"] == 1
+    assert stats["stages"]["stream_report"]["bytes"] > 0
+
+
+@pytest.mark.parametrize(
+    "profile, stats_suffix", [("cprofile", ".prof"), ("sampling", ".folded")]
+)
+def test_main_profile(tmp_path: Path, profile: str, stats_suffix: str):
+    report_dir = run_main(
+        tmp_path,
+        {"PROFILE": profile, "PROFILE_TOP": 5},
+        {
+            "nginx-access-ui.log-20230601": (
+                b'1.1.1.1 - - [-] "GET /a HTTP/1.1" 200 1 "-" "-" 0.5\n' * 20000
+            )
+        },
+    )
+
+    assert (report_dir / "report-20230601.html").exists()
+
+    stats_files = list(report_dir.glob(f"profile-*{stats_suffix}"))
+    summary_files = list(report_dir.glob("profile-*.txt"))
+
+    assert len(stats_files) == 1
+    assert len(summary_files) == 1
+    assert summary_files[0].read_text()
+
+
+@pytest.mark.parametrize(
+    "url_query, url_collapse_ids, url_rewrite_rules, url, expected",
+    [
+        ("strip", False, (), "/api/banner/1?b=2&a=1", "/api/banner/1"),
+        ("sort", False, (), "/api/banner/1?b=2&a=1", "/api/banner/1?a=1&b=2"),
+        ("keep", True, (), "/api/banner/123/img?x=1", "/api/banner/{id}/img?x=1"),
+        (
+            "strip",
+            True,
+            (),
+            "/u/0f8fad5b-d9cb-469f-a165-70867728950e/deadbeefdeadbeef00/v2",
+            "/u/{uuid}/{hash}/v2",
+        ),
+        ("keep", False, ((r"^/export/.*", "/export/*"),), "/export/a/b", "/export/*"),
+        ("keep", True, (), "/api/v2/list", "/api/v2/list"),
+    ],
+)
+def test_get_url_normalizer(
+    url_query: str, url_collapse_ids: bool, url_rewrite_rules, url: str, expected
+):
+    normalize_url = app.get_url_normalizer(
+        url_query, url_collapse_ids, url_rewrite_rules
+    )
+
+    assert normalize_url is not None
+    assert normalize_url(url) == expected
+    assert normalize_url(url) is normalize_url(url)
+
+
+def test_parse_entries_normalized():
+    normalize_url = app.get_url_normalizer("strip", True)
+    parser = [("/banner/1?x=1", 0.5), None, ("/banner/2", 0.25), ("/other", 1.0)]
+
+    parser_output = app.parse_entries(parser, normalize_url=normalize_url)
+
+    assert sorted(parser_output.entries) == ["/banner/{id}", "/other"]
+    assert parser_output.entries["/banner/{id}"].count == 2
+    assert app.get_url_normalizer() is None
+
+
+@pytest.mark.parametrize("backend", ["exact", "tdigest"])
+def test_parse_entries_heavy_hitters(backend: str):
+    rnd = random.Random(1)
+    entries = [(f"/hot/{idx}", 10.0 - idx) for idx in range(5) for _ in range(50)]
+    entries += [(f"/scan/{rnd.randrange(5000)}", 0.01) for _ in range(5000)]
+    rnd.shuffle(entries)
+
+    true_sums: Dict[str, float] = {}
+    for url, request_time in entries:
+        true_sums[url] = true_sums.get(url, 0.0) + request_time
+
+    parser_output = app.parse_entries(entries, backend, heavy_hitters_capacity=20)
+    tracked = parser_output.entries
+
+    assert len(tracked) <= 2 * 20 + 1
+    assert sum(aggregate.count for aggregate in tracked.values()) == len(entries)
+    assert sum(a.time_sum for a in tracked.values()) == pytest.approx(
+        parser_output.total["request_time"]
+    )
+
+    for url, aggregate in tracked.items():
+        if url != app.OTHER_URL:
+            assert aggregate.time_sum <= true_sums[url] + 1e-9
+            assert true_sums[url] <= aggregate.time_sum + aggregate.error + 1e-9
+
+    top = app.select_top_entries(tracked, 5)
+    assert list(top)[:5] == [f"/hot/{idx}" for idx in range(5)]
+    assert list(top)[5:] == [app.OTHER_URL]
+    assert tracked[app.OTHER_URL].error > 0
+
+
+def test_parse_log_parallel_heavy_hitters(tmp_path: Path):
+    log_path = tmp_path / "nginx-access-ui.log-20230601"
+    lines = ['1.1.1.1 - - [-] "GET /hot HTTP/1.1" 200 1 "-" "-" 1.0\n'] * 200
+    lines += [
+        f'1.1.1.1 - - [-] "GET /scan/{idx} HTTP/1.1" 200 1 "-" "-" 0.01\n'
+        for idx in range(2000)
+    ]
+    log_path.write_text("".join(lines))
+
+    options = app.ParseOptions(workers=4, heavy_hitters_capacity=10)
+    parser_output = app.parse_log_parallel(str(log_path), 4, options)
+
+    assert list(app.select_top_entries(parser_output.entries, 1)) == [
+        "/hot",
+        app.OTHER_URL,
+    ]
+    assert sum(a.count for a in parser_output.entries.values()) == len(lines)
+    assert parser_output.entries[app.OTHER_URL].error > 0
+
+
+def test_select_top_entries_other_row():
+    entries = app.parse_entries(
+        [(f"/scan/{idx}", 0.5) for idx in range(40)]
+        + [("/hot", 2.0)] * 3
+        + [("/warm", 1.0)] * 3,
+        "exact",
+        heavy_hitters_capacity=4,
+    )
+    assert entries.entries[app.OTHER_URL].time_sum > 6.0
+
+    top = app.select_top_entries(entries.entries, 2)
+    assert list(top) == ["/hot", "/warm", app.OTHER_URL]
+
+    metrics = app.get_report_metrics(entries, app.ReportOptions(report_size=2))
+    assert [m["url"] for m in metrics] == ["/hot", "/warm", app.OTHER_URL]
+
+
+def test_merge_parser_outputs_prunes_heavy_hitters():
+    outputs = [
+        app.parse_entries(
+            [(f"/url/{shard}/{idx}", 1.0 + idx) for idx in range(4)],
+            "exact",
+            heavy_hitters_capacity=4,
+        )
+        for shard in range(3)
+    ]
+    assert all(app.OTHER_URL not in output.entries for output in outputs)
+
+    merged = app.merge_parser_outputs(outputs, 4)
+    tracked = [url for url in merged.entries if url != app.OTHER_URL]
+
+    assert len(tracked) == 4
+    assert sorted(tracked) == sorted(
+        [f"/url/{shard}/3" for shard in range(3)] + ["/url/0/2"]
+    )
+    assert merged.entries[app.OTHER_URL].count == 8
+    assert merged.entries[app.OTHER_URL].error == 3.0
+    assert sum(a.count for a in merged.entries.values()) == 12
+
+    metrics = app.calculate_metrics(merged.entries, merged.total)
+    assert all("time_sum_error" in row for row in metrics)
+    assert (
+        "time_sum_error"
+        not in app.calculate_metrics(
+            make_entries({"/a": [1.0]}), {"entries": 1, "request_time": 1.0}
+        )[0]
+    )
+
+
+def test_merge_parser_outputs_mixed_heavy_hitters():
+    heavy = app.parse_entries(
+        [(f"/scan/{idx}", 0.5) for idx in range(10)] + [("/hot", 2.0)] * 3,
+        "exact",
+        heavy_hitters_capacity=2,
+    )
+    plain = app.ParserOutput(
+        make_entries({"/hot": [1.0], "/cold": [0.1]}),
+        {"entries": 2, "request_time": 1.1},
+    )
+    threshold = heavy.entries[app.OTHER_URL].error
+    assert threshold > 0
+
+    merged = app.merge_parser_outputs([plain, heavy])
+
+    assert merged.total["entries"] == 15
+    assert merged.entries["/cold"].count == 1
+    assert merged.entries["/cold"].error == threshold
+    assert merged.entries["/hot"].count == 4
+    assert merged.entries[app.OTHER_URL].error == threshold
+
+
+def test_parse_log_parallel_errors(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    valid = b'1.1.1.1 - - [-] "GET /a HTTP/1.1" 200 1 "-" "-" 0.5\n'
+    log_path = tmp_path / "nginx-access-ui.log-20230601"
+    log_path.write_bytes(valid * 3500 + b"broken\n" + valid * 499)
+
+    reported = []
+    monkeypatch.setattr(app, "report_parse_errors", lambda *args: reported.append(args))
+
+    options = app.ParseOptions(workers=4, max_error_ratio=0.0)
+    parser_output = app.parse_log(str(log_path), ".log", options)
+
+    assert len(reported) == 1
+    assert parser_output.errors.lines == 4000
+    assert parser_output.errors.failed == 1
+    assert parser_output.errors.samples == [
+        {"offset": len(valid) * 3500, "line": "broken"}
+    ]
+
+    monkeypatch.undo()
+
+    with pytest.raises(app.ParseErrorLimitExceeded):
+        app.parse_log(str(log_path), ".log", options)
+
+    assert (
+        app.parse_log(
+            str(log_path), ".log", options._replace(max_error_ratio=0.001)
+        ).errors.failed
+        == 1
+    )
+
+
+@pytest.mark.parametrize("rows", [0, 1, 2500])
+def test_stream_report(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, sample_metrics, rows: int
+):
+    monkeypatch.setattr(app, "REPORT_WRITE_BATCH", 1000)
+    metrics = (sample_metrics * 500)[:rows]
+    template = "<script>var table = $table_json;</script><p>Отчёт $table_json</p>"
     report_path = tmp_path / "report.html"
 
-    result = app.save_report(str(report_path), report_content)
+    written = app.stream_report(
+        str(report_path), app.split_report_template(template), metrics
+    )
 
-    assert result == len(report_content)
-    with open(report_path, encoding="utf-8") as file:
-        saved_content = file.read()
-    assert saved_content == report_content
+    expected = template.replace("$table_json", json.dumps(metrics))
+    assert report_path.read_text(encoding="utf-8") == expected
+    assert written == len(expected.encode("utf-8"))
+    assert list(tmp_path.iterdir()) == [report_path]
 
 
-def test_main(tmp_path: Path):
-    log_dir = tmp_path / "log"
-    log_dir.mkdir()
+def test_stream_report_failure(tmp_path: Path):
+    report_path = tmp_path / "report.html"
+    report_path.write_text("previous report")
+
+    with pytest.raises(TypeError):
+        app.stream_report(
+            str(report_path),
+            app.split_report_template("<$table_json>"),
+            [{"url": object()}],
+        )
 
-    log_file = log_dir / "nginx-access-ui.log-20230605"
-    log_file.write_text(
-        '192.168.1.1 - - [01/Jan/2023:00:00:01 +0000] "GET /index.html HTTP/1.1" 200 1234 "-" "Mozilla/5.0" 0.123\n'
-        '192.168.1.2 - - [01/Jan/2023:00:00:02 +0000] "POST /api/data HTTP/1.1" 201 567 "-" "PostmanRuntime/7.28.4" 0.456\n'
-        '192.168.1.3 - - [01/Jan/2023:00:00:03 +0000] "Invalid log entry" 400 100 "-" "-" 0.789\n'
-        '192.168.1.4 - - [01/Jan/2023:00:00:04 +0000] "PUT /update HTTP/1.1" 204 0 "-" "curl/7.68.0" 0.234\n'
+    assert report_path.read_text() == "previous report"
+    assert list(tmp_path.iterdir()) == [report_path]
+
+
+def test_report_template_default(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.chdir(tmp_path)
+
+    assert os.path.isabs(app.ReportOptions().template_path)
+    assert app.get_template_parts(app.ReportOptions().template_path) is not None
+
+
+def test_get_template_parts(tmp_path: Path):
+    template_path = tmp_path / "template.html"
+    template_path.write_text(
+        "<h1>$report_date</h1><script>$table = $table_json;</script>"
     )
 
-    report_dir = tmp_path / "reports"
-    report_dir.mkdir()
+    template_parts = app.get_template_parts(str(template_path))
 
-    config_text = json.dumps({"REPORT_DIR": str(report_dir), "LOG_DIR": str(log_dir)})
-    config_file = tmp_path / "config.json"
-    config_file.write_text(config_text)
+    assert template_parts == [
+        "<h1>",
+        "report_date",
+        "</h1><script>$table = ",
+        "table_json",
+        ";</script>",
+    ]
+    assert app.get_template_parts(str(template_path)) is template_parts
 
-    expected_report_path = report_dir / "report-20230605.html"
+    template_path.write_text("$total_entries|$stage_timings|$table_json")
+    os.utime(template_path, ns=(0, 0))
 
-    app.main(["--config", str(config_file)])
+    template_parts = app.get_template_parts(str(template_path))
+    assert template_parts is not None
 
-    assert expected_report_path.exists()
-    with open(expected_report_path, encoding="utf-8") as report_file:
-        report_content = report_file.read()
-    assert "$table_json" not in report_content
+    report_path = tmp_path / "report.html"
+    stats = app.PipelineStats()
+
+    with stats.stage("parse"):
+        pass
+
+    context = app.get_report_context(
+        "20230601", {"entries": 3, "request_time": 1.5}, stats
+    )
+    app.stream_report(str(report_path), template_parts, [{"url": "/a"}], context)
+
+    total_entries, stage_timings, table_json = report_path.read_text().split("|")
+    assert total_entries == "3"
+    assert list(json.loads(stage_timings)) == ["parse"]
+    assert json.loads(table_json) == [{"url": "/a"}]
+
+    assert app.get_template_parts(str(tmp_path / "missing.html")) is None
+
+
+@pytest.fixture
+def report_metrics(sample_parser_output: app.ParserOutput) -> List[Dict]:
+    return app.get_report_metrics(sample_parser_output)
+
+
+def test_stream_jsonl_report(tmp_path: Path, report_metrics: List[Dict]):
+    report_path = tmp_path / "report.jsonl"
+
+    written = app.stream_jsonl_report(str(report_path), report_metrics)
+
+    lines = report_path.read_text().splitlines()
+    assert written == report_path.stat().st_size
+    assert [json.loads(line) for line in lines] == report_metrics
+
+
+def test_stream_csv_report(tmp_path: Path, report_metrics: List[Dict]):
+    report_path = tmp_path / "report.csv"
+
+    app.stream_csv_report(str(report_path), report_metrics)
+
+    with open(report_path, encoding="utf-8", newline="") as report_file:
+        rows = list(csv.DictReader(report_file))
+
+    assert list(rows[0]) == app.REPORT_COLUMNS
+    assert [row["url"] for row in rows] == [row["url"] for row in report_metrics]
+    assert float(rows[0]["time_sum"]) == pytest.approx(report_metrics[0]["time_sum"])
+
+
+def test_write_parquet_report(tmp_path: Path, report_metrics: List[Dict]):
+    parquet = pytest.importorskip("pyarrow.parquet")
+    report_path = tmp_path / "report.parquet"
+
+    app.write_parquet_report(str(report_path), report_metrics)
+
+    assert parquet.read_table(report_path).to_pylist() == report_metrics
+
+
+def test_main_report_format(tmp_path: Path):
+    report_dir = run_main(
+        tmp_path,
+        {"REPORT_FORMAT": "jsonl"},
+        {
+            "nginx-access-ui.log-20230601": (
+                b'1.1.1.1 - - [-] "GET /a HTTP/1.1" 200 1 "-" "-" 0.5\n'
+            )
+        },
+    )
+
+    assert [path.name for path in report_dir.iterdir()] == ["report-20230601.jsonl"]
+    row = json.loads((report_dir / "report-20230601.jsonl").read_text())
+    assert row["url"] == "/a"
+
+
+def test_main_report_pages(tmp_path: Path):
+    log_content = "".join(
+        f'1.1.1.1 - - [-] "GET /url{idx} HTTP/1.1" 200 1 "-" "-" {idx}.5\n'
+        for idx in range(5)
+    )
+    report_dir = run_main(
+        tmp_path,
+        {"REPORT_PAGE_SIZE": 2},
+        {"nginx-access-ui.log-20230601": log_content.encode()},
+    )
+
+    report_content = (report_dir / "report-20230601.html").read_text()
+    pages_dir = report_dir / "report-20230601.pages"
+
+    assert "$report_pages" not in report_content
+    assert '"count": 3' in report_content
+    assert '"path": "report-20230601.pages"' in report_content
+    assert sorted(path.name for path in pages_dir.iterdir()) == [
+        "page-00001.js",
+        "page-00002.js",
+    ]
+
+    page_content = (pages_dir / "page-00002.js").read_text()
+    assert page_content.startswith("reportPage(2, ")
+    assert page_content.endswith(");\n")
+
+    rows = json.loads(page_content[len("reportPage(2, ") : -len(");\n")])
+    assert [row["url"] for row in rows] == ["/url0"]
+
+    run_main(tmp_path, {"REPORT_PAGE_SIZE": 0, "OVERWRITE_REPORT": True})
+
+    assert not pages_dir.exists()
+    assert "var pages = null;" in (report_dir / "report-20230601.html").read_text()
+
+
+def test_backfill_reports_worker_error(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    log_content = b'1.1.1.1 - - [-] "GET /a HTTP/1.1" 200 1 "-" "-" 0.5\n'
+    (tmp_path / "nginx-access-ui.log-20230601").write_bytes(log_content)
+    (tmp_path / "nginx-access-ui.log-20230602.gz").write_bytes(
+        gzip.compress(log_content)
+    )
+
+    def fail_gzip(*args, **kwargs):
+        raise RuntimeError("unexpected")
+
+    monkeypatch.setitem(app.CODECS, ".gz", fail_gzip)
+
+    tasks = app.get_unreported_logs(
+        app.search_logs(os.listdir(tmp_path)), str(tmp_path), str(tmp_path)
+    )
+    timings = app.backfill_reports(tasks, 1)
+
+    assert timings["nginx-access-ui.log-20230602.gz"] is None
+    assert timings["nginx-access-ui.log-20230601"] is not None
+    assert (tmp_path / "report-20230601.html").exists()
+
+
+def test_process_log_zstd_missing(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    log_path = tmp_path / "nginx-access-ui.log-20230601.zst"
+    log_path.write_bytes(b"not really zstd")
+    monkeypatch.setattr(app, "zstandard", None)
+
+    with pytest.raises(app.CODEC_ERRORS):
+        app.CODECS[".zst"](str(log_path))
+
+    log_file = app.LogFile(log_path.name, "20230601", ".zst")
+    report_path = tmp_path / "report-20230601.html"
+
+    assert app.process_log(log_file, str(log_path), str(report_path)) is None
+    assert not report_path.exists()